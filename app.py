@@ -1,11 +1,9 @@
 import os
 import json
 
-import pandas as pd
 import streamlit as st
 
 import logic as lg
-from scrape import Scrape
 
 
 st.set_page_config(
@@ -40,25 +38,27 @@ lg.multiselect_with_addition(label1, label2, key1, key2)
 st.write("")
 st.subheader("Scrape the Internet!")
 st.write("Actually, just Reddit.")
-scraper = Scrape(skip_if_file_exists=False)
+topic_model_settings = lg.topic_model_settings(config)
 scrape = st.button("Scrape!")
 
 if scrape:
     lg.save_config_file(config)
-    scraper.scrape()
-
-if scraper.documents:
-    for kw, output_file in zip(st.session_state["keywords_to_scrape"], scraper.output_files):
-        df = pd.read_csv(output_file)
-        df.drop(columns=["Unnamed: 0"], inplace=True)
-        st.markdown(f"**{kw}**")
-        st.dataframe(df)
-    
-        st.download_button("Download CSV",
-            df.to_csv().encode("utf-8"),
-            f"{kw}.csv",
-            "text/csv",
-            key=f"{kw}_dwnld"
-            )
+    # runs in the background, the page keeps responding and shows its progress
+    lg.start_job("scrape", lg.run_scrape, topic_model_settings)
 
+job = lg.display_job("scrape")
+if job is not None and job.result is not None:
+    st.session_state["scrape_result"] = job.result
 
+result = st.session_state.get("scrape_result")
+if result:
+    lg.display_scraped_data_in_tables(result["output_files"])
+
+    st.write("")
+    st.subheader("Topics")
+    if st.button("Fit topics"):
+        lg.start_job("topic model", lg.run_topic_model, result["output_files"], result["document_filters"], topic_model_settings)
+    lg.display_job("topic model")
+
+    if lg.saved_topic_model_exists():
+        lg.display_topics(result["output_files"], result["document_filters"], topic_model_settings)
@@ -0,0 +1,154 @@
+import os
+import json
+import shutil
+import sqlite3
+import hashlib
+import datetime
+
+from checkpoint import write_atomic
+
+
+ARTIFACTS = "data/topic_model"
+
+
+def version_dirs(name, root=ARTIFACTS):
+    """Returns the saved versions of the model `name`, oldest first."""
+    folder = os.path.join(root, name)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(d for d in os.listdir(folder) if d.startswith("v") and d[1:].isdigit())
+
+
+def latest_version(name, root=ARTIFACTS):
+    """Returns the newest version of the model `name`, None if it was never saved."""
+    versions = version_dirs(name, root)
+    return versions[-1] if versions else None
+
+
+def save_artifact(model, embedder, name, root=ARTIFACTS, keep=5, **meta):
+    """Saves a fitted BERTopic model as a new version of `name`.
+
+    The artifact folder holds the pickled model (reducer, clusterer, vectorizer
+    and c-TF-IDF, without the embedding model) next to a meta.json recording
+    the embedding model it needs. Only the newest `keep` versions are kept.
+
+    Args:
+        model (BERTopic): fitted model
+        embedder (Embedder): the embedding stage the model was fitted with
+        name (str): model name, e.g. "batch" or "online"
+        root (str, optional): artifacts folder. Defaults to ARTIFACTS.
+        keep (int, optional): how many versions to keep. Defaults to 5.
+        **meta: anything else worth recording, e.g. the number of documents
+
+    Returns:
+        str: the folder of the new version
+    """
+    latest = latest_version(name, root)
+    version = f"v{int(latest[1:]) + 1 if latest else 1:04d}"
+    path = os.path.join(root, name, version)
+
+    meta = dict(
+        meta,
+        name=name,
+        version=version,
+        created=datetime.datetime.utcnow().isoformat(),
+        embedding_model=embedder.model_name,
+        embedding_version=embedder.version,
+        quantize=embedder.quantize,
+    )
+
+    def write(tmp_path):
+        os.makedirs(tmp_path)
+        model.save(os.path.join(tmp_path, "model"), save_embedding_model=False)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    write_atomic(path, write)
+
+    for old in version_dirs(name, root)[:-keep]:
+        shutil.rmtree(os.path.join(root, name, old))
+
+    return path
+
+
+def load_artifact(name, root=ARTIFACTS, version=None, embedding_model=None):
+    """Loads a saved BERTopic model.
+
+    Args:
+        name (str): model name
+        root (str, optional): artifacts folder. Defaults to ARTIFACTS.
+        version (str, optional): e.g. "v0003". if none, the newest version.
+        embedding_model (optional): embedding model to attach to the loaded model
+
+    Raises:
+        FileNotFoundError: if the model was never saved
+
+    Returns:
+        tuple of the BERTopic model and its meta dictionary
+    """
+    from bertopic import BERTopic
+
+    version = version or latest_version(name, root)
+    if version is None:
+        raise FileNotFoundError(f"No saved topic model named {name} in {root}")
+
+    path = os.path.join(root, name, version)
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+
+    model = BERTopic.load(os.path.join(path, "model"), embedding_model=embedding_model)
+    return model, meta
+
+
+class SeenDocuments:
+    def __init__(self, name, root=ARTIFACTS):
+        """The documents the model `name` was updated with, as 20-byte sha1 digests in a sqlite table.
+
+        Looking up a batch and adding its new documents only touch the rows of
+        that batch, so an update costs the same however many documents the
+        model saw before. The table isn't versioned with the model: it records
+        the version that first saw every document instead.
+
+        Args:
+            name (str): model name, e.g. "online"
+            root (str, optional): artifacts folder. Defaults to ARTIFACTS.
+        """
+        self.path = os.path.join(root, name, "seen.db")
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS seen (digest BLOB PRIMARY KEY, version TEXT NOT NULL) WITHOUT ROWID")
+
+
+    @staticmethod
+    def digest(doc):
+        return hashlib.sha1(doc.encode("utf-8")).digest()
+
+
+    def seen(self, digests, chunk_size=500):
+        """Returns the subset of `digests` already in the table."""
+        digests = list(set(digests))
+        found = set()
+        # below sqlite's limit on the number of query parameters
+        for start in range(0, len(digests), chunk_size):
+            chunk = digests[start:start + chunk_size]
+            rows = self.connection.execute(
+                f"SELECT digest FROM seen WHERE digest IN ({', '.join('?' * len(chunk))})", chunk).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+
+
+    def add(self, digests, version):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO seen VALUES (?, ?)", ((digest, version) for digest in digests))
+
+
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM seen")
+
+
+    def close(self):
+        self.connection.close()
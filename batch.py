@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import socket
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+
+JOBS = "data/jobs"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# exit status of a job that found its output folder locked by another run (EX_TEMPFAIL)
+LOCKED_EXIT = 75
+
+
+class JobLockedError(Exception):
+    pass
+
+
+class JobLock:
+    def __init__(self, path):
+        """Lock file that keeps two runs of the same job from sharing an output folder.
+
+        The file is created atomically and holds the host and process id of its
+        owner. A lock left behind by a process of this host that no longer runs
+        is taken over; locks of other hosts (e.g. on a shared disk) are never
+        broken automatically.
+
+        Args:
+            path (str): the lock file
+        """
+        self.path = path
+        self.owner = {"host": socket.gethostname(), "pid": os.getpid()}
+
+
+    def acquire(self):
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self.stale():
+                    raise JobLockedError(f"{self.path} is held by {self.holder()}")
+                os.remove(self.path)
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump(dict(self.owner, started=datetime.utcnow().isoformat()), f)
+            return self
+        raise JobLockedError(f"Could not take over the stale lock {self.path}")
+
+
+    def release(self):
+        if self.holder() == self.owner:
+            os.remove(self.path)
+
+
+    def holder(self):
+        try:
+            with open(self.path) as f:
+                holder = json.load(f)
+        except (OSError, ValueError):
+            # being written right now, or gone
+            return None
+        return {"host": holder.get("host"), "pid": holder.get("pid")}
+
+
+    def stale(self):
+        holder = self.holder()
+        if holder is None or holder["host"] != self.owner["host"] or os.name == "nt":
+            # signal 0 is ctrl-c on windows, so there is no safe way to probe the process
+            return False
+        try:
+            os.kill(holder["pid"], 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+        return False
+
+
+    def __enter__(self):
+        return self.acquire()
+
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def load_specs(paths, output_root=JOBS):
+    """Reads job specs. Every file holds one config like config.json, or a list of them.
+
+    Settings missing from a spec come from config_default.json. A spec may
+    also set its `name` (by default the file name, numbered for lists) and
+    its `output_dir` (by default a folder named after the job in `output_root`).
+
+    Args:
+        paths (list of str): spec files
+        output_root (str, optional): folder of the job output folders. Defaults to JOBS.
+
+    Returns:
+        list of configs, each with a name and an absolute output_dir
+    """
+    with open(os.path.join(HERE, "config_default.json")) as f:
+        defaults = json.load(f)
+
+    specs = []
+    for path in paths:
+        with open(path) as f:
+            configs = json.load(f)
+        stem = os.path.splitext(os.path.basename(path))[0]
+        if isinstance(configs, dict):
+            configs = [dict(configs, name=configs.get("name", stem))]
+        else:
+            configs = [dict(config, name=config.get("name", f"{stem}_{n}")) for n, config in enumerate(configs)]
+
+        for config in configs:
+            if os.sep in config["name"] or config["name"] in ("", ".", ".."):
+                raise ValueError(f"Job name {config['name']!r} of {path} can't be used as a folder name")
+            config = dict(defaults, **config)
+            config["output_dir"] = os.path.abspath(config.get("output_dir") or os.path.join(output_root, config["name"]))
+            specs.append(config)
+
+    output_dirs = [spec["output_dir"] for spec in specs]
+    duplicates = {d for d in output_dirs if output_dirs.count(d) > 1}
+    if duplicates:
+        raise ValueError(f"Jobs would share the output folders {sorted(duplicates)}, give them different names")
+    return specs
+
+
+def run_job(spec, skip_if_file_exists=True):
+    """Scrapes one job spec into its own output folder, then fits a topic model on it if the spec asks to.
+    Checkpoints, the embedding cache and the saved topic models all live in the output folder.
+
+    Returns:
+        dictionary summing up the run
+    """
+    # imported here so the runner itself starts fast, and only jobs that fit a model load BERTopic
+    from scrape import Scrape
+
+    output_dir = spec["output_dir"]
+    config_path = os.path.join(output_dir, "config.json")
+    with open(config_path, "w") as f:
+        json.dump(spec, f, indent=2)
+
+    start = time.time()
+    scraper = Scrape(skip_if_file_exists=skip_if_file_exists, config_path=config_path, output_dir=output_dir)
+    scraper.scrape()
+    summary = {"name": spec["name"], "output_files": scraper.output_files, "documents": len(scraper.documents)}
+
+    settings = spec.get("topic_model") or {}
+    if settings.get("fit") and scraper.documents:
+        from topic_model import configured_embedder, topic_model
+
+        topic_model(
+            scraper.documents,
+            configured_embedder(settings),
+            cache_dir=os.path.join(output_dir, "embeddings"),
+            cache_max_bytes=settings.get("cache_max_bytes"),
+            artifact_dir=os.path.join(output_dir, "topic_model"),
+            preset=settings.get("preset", "default"),
+            n_components=settings.get("n_components", 5),
+            n_clusters=settings.get("n_clusters", 50),
+            sample_size=settings.get("sample_size"),
+            metadata=scraper.document_frame)
+        summary["topic_model"] = os.path.join(output_dir, "topic_model")
+
+    summary["seconds"] = time.time() - start
+    return summary
+
+
+def run_jobs(specs, workers=1, skip_if_file_exists=True):
+    """Runs job specs as a queue, `workers` at a time.
+
+    Every job runs in a process of its own, so jobs don't share the metrics,
+    rate limiter or memory of another, and logs to job.log in its output
+    folder. A job whose output folder is locked by a run still in progress is
+    skipped. Every job has its own request budget, so `workers` multiplies the
+    request rate against the API.
+
+    Args:
+        specs (list of dict): configs from load_specs
+        workers (int, optional): jobs running at the same time. Defaults to 1.
+        skip_if_file_exists (bool, optional): keep the keyword files a previous run completed. Defaults to True.
+
+    Returns:
+        list with the status ("done", "locked" or "failed") and summary of every job
+    """
+    def run(spec):
+        os.makedirs(spec["output_dir"], exist_ok=True)
+        log_path = os.path.join(spec["output_dir"], "job.log")
+        result_path = os.path.join(spec["output_dir"], "result.json")
+        command = [sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(spec)]
+        if not skip_if_file_exists:
+            command.append("--overwrite")
+
+        print(f"[{spec['name']}] started, logging to {log_path}")
+        start = time.time()
+        # appended to, another run of the job may still be writing to it
+        with open(log_path, "a") as log:
+            log.write(f"\n=== {datetime.utcnow().isoformat()} pid {os.getpid()}\n")
+            log.flush()
+            returncode = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode
+
+        if returncode == 0:
+            with open(result_path) as f:
+                summary = json.load(f)
+            print(f"[{spec['name']}] done in {time.time() - start:.1f}s, {summary['documents']} documents")
+            return {"status": "done", **summary}
+        if returncode == LOCKED_EXIT:
+            print(f"[{spec['name']}] skipped, another run of this job holds its lock")
+            return {"status": "locked", "name": spec["name"]}
+        print(f"[{spec['name']}] failed with exit status {returncode}, see {log_path}")
+        return {"status": "failed", "name": spec["name"]}
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-job") as executor:
+        return list(executor.map(run, specs))
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run scrapes (and topic model fits) from job specs without the app, e.g. from cron.")
+    parser.add_argument("specs", nargs="*", help="job spec files: a config like config.json, or a list of them")
+    parser.add_argument("--workers", type=int, default=1, help="jobs running at the same time")
+    parser.add_argument("--output-root", default=JOBS, help="folder of the job output folders")
+    parser.add_argument("--overwrite", action="store_true", help="scrape keywords again even if a previous run completed them")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        spec = json.loads(args.run_one)
+        try:
+            with JobLock(os.path.join(spec["output_dir"], "job.lock")):
+                summary = run_job(spec, skip_if_file_exists=not args.overwrite)
+                with open(os.path.join(spec["output_dir"], "result.json"), "w") as f:
+                    json.dump(summary, f, indent=2)
+        except JobLockedError as e:
+            print(e)
+            sys.exit(LOCKED_EXIT)
+        sys.exit()
+
+    if not args.specs:
+        parser.error("give at least one job spec")
+
+    results = run_jobs(load_specs(args.specs, args.output_root), args.workers, not args.overwrite)
+    counts = {status: sum(result["status"] == status for result in results) for status in ["done", "locked", "failed"]}
+    print(f"{counts['done']} done, {counts['locked']} skipped, {counts['failed']} failed")
+    sys.exit(1 if counts["failed"] else 0)
@@ -0,0 +1,276 @@
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+
+BENCHMARKS = "benchmarks"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, None where the resource module is missing."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def fake_pushshift(start_date, end_date, settings):
+    """Serves a fake pushshift API from fake_pushshift.py in a process of its own,
+    so generating responses doesn't share the GIL, CPU time or memory of the scraper being measured.
+
+    Yields:
+        str: the base url of the fake API
+    """
+    command = [
+        sys.executable, "-u", os.path.join(HERE, "fake_pushshift.py"),
+        "--port", "0",
+        "--start-date", start_date,
+        "--end-date", end_date,
+        "--posts-per-day", str(settings["posts_per_day"]),
+        "--comments-per-day", str(settings["comments_per_day"]),
+        "--latency", str(settings["latency"]),
+        "--error-rate", str(settings["error_rate"]),
+    ]
+    if settings["requests_per_second"]:
+        command += ["--requests-per-second", str(settings["requests_per_second"])]
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        # port 0 lets the server pick a free port, which it prints once it listens
+        line = process.stdout.readline()
+        match = re.search(r"http://[^\s,]+", line)
+        if match is None:
+            raise RuntimeError(f"fake_pushshift.py didn't start: {line!r}")
+        yield match.group(0)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_once(settings):
+    """Scrapes a fake corpus, extracts its documents and fits a topic model on them, timing every stage.
+    Runs in the current directory, which should be empty.
+
+    Args:
+        settings (dict): posts_per_day, comments_per_day, days, latency, requests_per_second, error_rate, file_format, topic_model, preset
+
+    Returns:
+        dictionary with the measurements of every stage
+    """
+    start_date = datetime(2022, 3, 1)
+    end_date = start_date + timedelta(days=settings["days"])
+
+    # imported here, scrape picks its output folder from the working directory
+    from scrape import Scrape
+    from metrics import METRICS
+
+    class BenchmarkScrape(Scrape):
+        def clean_for_topic_modeling(self):
+            # timed as a stage of its own
+            pass
+
+    stages = {}
+    with fake_pushshift(start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"), settings) as api_url:
+        with open(os.path.join(HERE, "config_default.json")) as f:
+            config = json.load(f)
+        config.update(
+            keywords=["water"],
+            subreddits=[],
+            start_date=start_date.strftime("%Y-%m-%d"),
+            end_date=end_date.strftime("%Y-%m-%d"),
+            include_comments="True",
+            restart_from_file="false",
+            file_format=settings["file_format"],
+            corpus=None,
+            api_url=api_url,
+            requests_per_second=1000,
+            burst=100,
+            max_retries=10)
+        with open("config.json", "w") as f:
+            json.dump(config, f)
+
+        scraper = BenchmarkScrape(skip_if_file_exists=False)
+        start = time.time()
+        scraper.scrape()
+        elapsed = time.time() - start
+
+    # counted by the scraper's client, the fake API runs in another process
+    pages = METRICS.total("pages_total")
+    rows = METRICS.total("rows_total")
+    stages["scrape"] = {
+        "seconds": elapsed,
+        "pages": pages,
+        "pages_per_sec": pages / elapsed,
+        "rows": rows,
+        "rows_per_sec": rows / elapsed,
+        "response_bytes": METRICS.total("response_bytes_total"),
+        "throttled": METRICS.total("requests_total", status=429),
+        # the fake API fails requests with a 502
+        "errors": METRICS.total("requests_total", status=502),
+        "retries": METRICS.total("retries_total"),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    start = time.time()
+    Scrape.clean_for_topic_modeling(scraper)
+    elapsed = time.time() - start
+    stages["clean_for_topic_modeling"] = {
+        "seconds": elapsed,
+        "documents": len(scraper.documents),
+        "documents_per_sec": len(scraper.documents) / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+    if settings["topic_model"]:
+        from topic_model import topic_model
+
+        start = time.time()
+        topic_model(scraper.documents, cache_dir=None, artifact_dir=None, preset=settings["preset"])
+        elapsed = time.time() - start
+        stages["topic_model"] = {
+            "seconds": elapsed,
+            "documents_per_sec": len(scraper.documents) / elapsed,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    stages["end_to_end"] = {"seconds": sum(stage["seconds"] for stage in stages.values())}
+    return stages
+
+
+def benchmark(sizes, days=7, comments_per_post=3, latency=0.0, requests_per_second=None, error_rate=0.0,
+              file_format="csv", topic_model=True, preset="fast", verbose=False):
+    """Runs the pipeline against a local fake pushshift API for every corpus size.
+
+    Every size runs in a fresh process and an empty folder, so peak memory and
+    file caches of one run don't leak into the next. Peak memory is the peak of
+    the process up to the end of each stage.
+
+    Args:
+        sizes (list of int): submissions per day of every run
+        days (int, optional): days scraped. Defaults to 7.
+        comments_per_post (int, optional): comments per day as a multiple of the submissions. Defaults to 3.
+        latency (float, optional): seconds the fake API adds to every response. Defaults to 0.
+        requests_per_second (float, optional): rate limit of the fake API. if none, unlimited.
+        error_rate (float, optional): fraction of requests the fake API fails. Defaults to 0.
+        file_format (str, optional): scrape output format. Defaults to "csv".
+        topic_model (bool, optional): also time topic_model, which needs sentence-transformers. Defaults to True.
+        preset (str, optional): clustering preset of topic_model. Defaults to "fast".
+        verbose (bool, optional): show the output of the runs. Defaults to False.
+
+    Returns:
+        dictionary with the environment and the measurements of every run
+    """
+    runs = []
+    for size in sizes:
+        settings = dict(
+            posts_per_day=size,
+            comments_per_day=size * comments_per_post,
+            days=days,
+            latency=latency,
+            requests_per_second=requests_per_second,
+            error_rate=error_rate,
+            file_format=file_format,
+            topic_model=topic_model,
+            preset=preset)
+
+        work_dir = tempfile.mkdtemp(prefix="reddit-benchmark-")
+        try:
+            result_file = os.path.join(work_dir, "result.json")
+            output = None if verbose else subprocess.DEVNULL
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(settings), "--result-file", result_file],
+                cwd=work_dir, stdout=output, stderr=output, check=True)
+            with open(result_file) as f:
+                stages = json.load(f)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        print(f"{size} posts/day: " + ", ".join(f"{name} {stage['seconds']:.1f}s" for name, stage in stages.items()))
+        runs.append(dict(settings, stages=stages))
+
+    return {
+        "created": datetime.utcnow().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "runs": runs,
+    }
+
+
+def compare(baseline, results):
+    """Prints the time of every stage next to the baseline's, for the corpus sizes both ran."""
+    baseline_runs = {run["posts_per_day"]: run for run in baseline["runs"]}
+    print(f"{'posts/day':>10} {'stage':<26} {'baseline':>10} {'now':>10} {'change':>8}")
+    for run in results["runs"]:
+        old_run = baseline_runs.get(run["posts_per_day"])
+        if old_run is None:
+            continue
+        for name, stage in run["stages"].items():
+            if name not in old_run["stages"]:
+                continue
+            old, new = old_run["stages"][name]["seconds"], stage["seconds"]
+            print(f"{run['posts_per_day']:>10} {name:<26} {old:>9.2f}s {new:>9.2f}s {(new - old) / old:>+8.0%}")
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark scraping, document extraction and topic modeling against a fake pushshift API.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000], help="submissions per day of every run")
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--comments-per-post", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the fake API adds to every response")
+    parser.add_argument("--requests-per-second", type=float, help="rate limit of the fake API")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests the fake API fails")
+    parser.add_argument("--file-format", default="csv")
+    parser.add_argument("--preset", default="fast", help="clustering preset of topic_model")
+    parser.add_argument("--skip-topic-model", action="store_true", help="only time the scrape and document extraction")
+    parser.add_argument("--output", help=f"results file. Defaults to a new file in {BENCHMARKS}/")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the runs")
+    parser.add_argument("--run-one", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        stages = run_once(json.loads(args.run_one))
+        with open(args.result_file, "w") as f:
+            json.dump(stages, f)
+        sys.exit()
+
+    results = benchmark(
+        args.sizes, args.days, args.comments_per_post, args.latency, args.requests_per_second, args.error_rate,
+        args.file_format, not args.skip_topic_model, args.preset, args.verbose)
+
+    output = args.output or os.path.join(BENCHMARKS, f"results-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved results to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
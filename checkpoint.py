@@ -0,0 +1,133 @@
+import os
+import re
+import json
+import shutil
+
+import pandas as pd
+
+
+class Checkpoint:
+    def __init__(self, path):
+        """Append-only store for the pages of one pull.
+
+        New pages are written as numbered segment files next to a small manifest
+        holding the paging cursor, so saving only costs the rows added since the
+        last save and resuming only needs to read the manifest.
+
+        Args:
+            path (str): directory holding the segments and the manifest
+        """
+        self.path = path
+        self.manifest_file = os.path.join(path, "manifest.json")
+        self.pending = []
+        self.manifest = self.read_manifest()
+
+
+    def read_manifest(self):
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        return {"cursor": None, "segments": [], "rows": 0, "complete": False}
+
+
+    @property
+    def cursor(self):
+        """created_utc_unix of the last saved record, None if nothing was saved yet."""
+        return self.manifest["cursor"]
+
+
+    @property
+    def complete(self):
+        return self.manifest["complete"]
+
+
+    def add(self, df):
+        """Queues one page to be written on the next flush."""
+        self.pending.append(df)
+
+
+    def flush(self):
+        """Writes the pages queued since the last flush as a new segment."""
+        if not self.pending:
+            return
+
+        os.makedirs(self.path, exist_ok=True)
+        segment = pd.concat(self.pending, ignore_index=True)
+        name = f"segment-{len(self.manifest['segments']):05d}.pkl"
+        write_atomic(os.path.join(self.path, name), segment.to_pickle)
+
+        self.manifest["segments"].append(name)
+        self.manifest["rows"] += len(segment)
+        self.manifest["cursor"] = int(segment["created_utc_unix"].max())
+        self.write_manifest()
+        self.pending = []
+
+
+    def finish(self):
+        """Flushes what is left and marks the pull as done."""
+        self.flush()
+        self.manifest["complete"] = True
+        if self.manifest["segments"]:
+            self.write_manifest()
+
+
+    def write_manifest(self):
+        def dump(path):
+            with open(path, "w") as f:
+                json.dump(self.manifest, f)
+
+        write_atomic(self.manifest_file, dump)
+
+
+    def load(self):
+        """Reads every saved segment plus the pages not flushed yet.
+
+        Returns:
+            dataframe with all the records of the pull
+        """
+        frames = [pd.read_pickle(os.path.join(self.path, name)) for name in self.manifest["segments"]]
+        frames += self.pending
+        frames = [df for df in frames if not df.empty]
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True).drop_duplicates(subset="id", ignore_index=True)
+
+
+    def clear(self):
+        """Deletes the checkpoint from disk."""
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+        self.pending = []
+        self.manifest = self.read_manifest()
+
+
+
+def write_atomic(path, write, suffix=".tmp"):
+    """Has `write` save to a temporary path next to `path`, then renames it to `path`.
+
+    A crash half way through a save leaves the previous file in place, so
+    readers only ever see complete files (or folders).
+
+    Args:
+        path (str): file or folder to write
+        write (callable): called with the temporary path to save to
+        suffix (str, optional): appended to `path` for the temporary path, e.g. to keep an extension. Defaults to ".tmp".
+    """
+    tmp_path = f"{path}{suffix}"
+    # left over by a save that crashed
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def remove_checkpoints(path):
+    """Deletes the checkpoint at `path` and the per-window checkpoints next to it (`path`_0, `path`_1, ...)."""
+    folder, name = os.path.split(path)
+    if not os.path.isdir(folder):
+        return
+
+    pattern = re.compile(rf"^{re.escape(name)}(_\d+)?$")
+    for entry in os.listdir(folder):
+        if pattern.match(entry):
+            Checkpoint(os.path.join(folder, entry)).clear()
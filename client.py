@@ -0,0 +1,225 @@
+import re
+import json
+import time
+import threading
+from urllib.parse import urlparse
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from ratelimit import RateLimiter
+from metrics import METRICS, BYTES_BUCKETS, ROWS_BUCKETS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# where the pushshift API lives, e.g. point it at fake_pushshift for offline runs
+API_URL = "https://api.pushshift.io"
+
+# smallest page the client falls back to when the API rejects a page size
+MIN_PAGE_SIZE = 100
+
+
+class PushshiftError(Exception):
+    """Raised when the pushshift API keeps failing, as opposed to running out of data."""
+
+
+class PushshiftClient:
+    def __init__(self, rate_limiter=None, timeout=60, pool_size=10, api_url=API_URL, page_size=None, comment_page_size=None):
+        """HTTP transport shared by every Reddit instance of a scrape.
+
+        Each worker thread gets its own keep-alive session (sessions are not
+        thread safe), all of them drawing from the same rate limiter.
+
+        Pages of submissions are requested at `page_size` records and pages of
+        comments at `comment_page_size`. If the API rejects a size as too
+        large, it is halved (down to MIN_PAGE_SIZE) and kept for every later
+        request to the same endpoint. Halving is a heuristic: it never probes upward
+        again, so a scrape settles on an accepted size within a factor of two
+        of the largest one, not on the largest one itself.
+
+        Args:
+            rate_limiter (RateLimiter, optional): request budget. Defaults to one request every 2 seconds.
+            timeout (float or tuple, optional): requests timeout in seconds, or a (connect, read) pair. Defaults to 60.
+            pool_size (int, optional): connections kept open per host and session. Defaults to 10.
+            api_url (str, optional): base url of the pushshift API. Defaults to API_URL.
+            page_size (int, optional): submissions per page to start with. if none, Reddit.create_url's default.
+            comment_page_size (int, optional): comments per page to start with. if none, Reddit.create_url's default.
+        """
+        self.rate_limiter = rate_limiter or RateLimiter(requests_per_second=0.5)
+        self.timeout = tuple(timeout) if isinstance(timeout, list) else timeout
+        self.pool_size = pool_size
+        self.api_url = (api_url or API_URL).rstrip("/")
+        # keyed by whether the endpoint serves comments
+        self.page_sizes = {False: page_size, True: comment_page_size}
+        self._local = threading.local()
+        self._page_size_lock = threading.Lock()
+
+
+    @property
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({
+                "Accept": "application/json",
+                "Accept-Encoding": "gzip, deflate",
+                "Connection": "keep-alive",
+            })
+            self._local.session = session
+        return session
+
+
+    def get_data(self, url):
+        """Fetches one page and returns its records.
+        Rate limited (429) and server side (5xx) errors are retried with backoff,
+        so an empty dataframe always means there is no more data.
+
+        Args:
+            url (string): the url to query
+
+        Raises:
+            PushshiftError: if the request still fails after all retries
+
+        Returns:
+            dataframe with one row per record
+        """
+        rate_limiter = self.rate_limiter
+
+        for attempt in range(rate_limiter.max_retries + 1):
+            if attempt:
+                METRICS.count("retries_total")
+
+            try:
+                r = self.request(url)
+                # asked for more than the API serves at once: not a failed request, so it doesn't use up a retry
+                while PushshiftClient.page_size_rejected(r) and self.shrink_page_size(url):
+                    url = re.sub(r"([?&]size=)\d+", rf"\g<1>{self.page_sizes[PushshiftClient.is_comment_url(url)]}", url)
+                    r = self.request(url)
+            except requests.RequestException as e:
+                error = f"{type(e).__name__}: {e}"
+                if attempt < rate_limiter.max_retries:
+                    rate_limiter.on_throttle(attempt)
+                continue
+
+            if r.status_code == 429 or r.status_code >= 500:
+                error = f"HTTP {r.status_code}"
+                # backing off after the last attempt would only slow down every other worker
+                if attempt < rate_limiter.max_retries:
+                    delay = rate_limiter.on_throttle(attempt, r.headers)
+                    print(f"{error}, retrying in {delay:.1f}s")
+                continue
+
+            if r.status_code != 200:
+                raise PushshiftError(f"HTTP {r.status_code} for {url}")
+
+            try:
+                with METRICS.timer("decode_seconds"):
+                    data = PushshiftClient.decode(r.content)
+            except (ValueError, KeyError, TypeError) as e:
+                # a truncated or malformed body is a failed request, not the end of the data
+                error = f"bad response body: {e}"
+                METRICS.count("bad_responses_total")
+                if attempt < rate_limiter.max_retries:
+                    rate_limiter.on_throttle(attempt)
+                continue
+
+            rate_limiter.on_success(r.headers)
+            METRICS.count("pages_total")
+            METRICS.count("rows_total", len(data))
+            METRICS.count("response_bytes_total", len(r.content))
+            METRICS.observe("page_rows", len(data), ROWS_BUCKETS)
+            METRICS.observe("page_bytes", len(r.content), BYTES_BUCKETS)
+            return data
+
+        raise PushshiftError(f"{error} for {url} after {rate_limiter.max_retries + 1} attempts")
+
+
+    def request(self, url):
+        """Sends one rate limited GET request and records its metrics."""
+        with METRICS.timer("rate_limit_wait_seconds"):
+            self.rate_limiter.wait()
+
+        start = time.perf_counter()
+        try:
+            r = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            METRICS.count("requests_total", status=type(e).__name__)
+            raise
+        finally:
+            METRICS.observe("request_seconds", time.perf_counter() - start)
+
+        METRICS.count("requests_total", status=r.status_code)
+        return r
+
+
+    @staticmethod
+    def page_size_rejected(r):
+        """Whether the API refused a request for asking for too many records at once.
+
+        413 always means that. A 400 or 422 only counts when its body names the
+        size parameter, other bad requests are not retried with smaller pages.
+        """
+        if r.status_code == 413:
+            return True
+        return r.status_code in (400, 422) and re.search(r"\bsize\b", r.text, re.IGNORECASE) is not None
+
+
+    @staticmethod
+    def is_comment_url(url):
+        return "/comment/" in urlparse(url).path
+
+
+    def shrink_page_size(self, url):
+        """Halves the page size of the endpoint of `url` after the API rejected the one in `url`. Returns False if it can't shrink."""
+        match = re.search(r"[?&]size=(\d+)", url)
+        if match is None or int(match.group(1)) <= MIN_PAGE_SIZE:
+            return False
+
+        rejected = int(match.group(1))
+        comment = PushshiftClient.is_comment_url(url)
+        with self._page_size_lock:
+            # another thread may have shrunk it already
+            current = self.page_sizes[comment] or rejected
+            size = max(MIN_PAGE_SIZE, min(current, rejected // 2))
+            if size < current:
+                print(f"{'Comment' if comment else 'Submission'} page size {rejected} rejected, using {size}")
+            self.page_sizes[comment] = size
+        METRICS.count("page_size_rejections_total")
+        return True
+
+
+    @staticmethod
+    def decode(content):
+        """Decodes a pushshift response body straight from bytes into dataframe columns.
+
+        Args:
+            content (bytes): raw (already decompressed) response body
+
+        Returns:
+            dataframe with one row per record
+        """
+        if orjson is not None:
+            records = orjson.loads(content)["data"]
+        else:
+            records = json.loads(content)["data"]
+
+        if not records:
+            return pd.DataFrame()
+
+        # building columns first avoids pandas inferring a schema row by row
+        columns = {}
+        for n, record in enumerate(records):
+            for key, value in record.items():
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [None] * len(records)
+                column[n] = value
+        return pd.DataFrame(columns)
@@ -0,0 +1,121 @@
+import numpy as np
+import pandas as pd
+
+
+# document metadata (see documents.extract) a sample keeps the proportions of
+STRATA = ["subreddit", "keyword", "day", "is_comment"]
+
+# "default" is BERTopic's own UMAP + HDBSCAN, the other presets trade some topic
+# quality for throughput and a memory footprint that grows linearly with the corpus
+PRESETS = ["default", "fast", "fastest"]
+
+
+def topic_model_components(preset="default", n_components=5, n_clusters=50, random_state=0):
+    """Returns the dimensionality reduction and clustering models of a preset.
+
+    - default: UMAP + HDBSCAN, BERTopic's defaults. Finds the number of topics
+      and outliers by itself, but slows down and needs a lot of memory on
+      hundreds of thousands of documents.
+    - fast: PCA + MiniBatchKMeans. Linear in the number of documents.
+    - fastest: random projection + MiniBatchKMeans. Skips fitting the reduction.
+
+    Args:
+        preset (str, optional): one of PRESETS. Defaults to "default".
+        n_components (int, optional): dimensions kept by the reduction of the fast presets. Defaults to 5.
+        n_clusters (int, optional): number of topics of the fast presets. Defaults to 50.
+        random_state (int, optional): seed of the fast presets. Defaults to 0.
+
+    Returns:
+        dictionary of BERTopic keyword arguments, empty for the default preset
+    """
+    if preset == "default":
+        return {}
+
+    from sklearn.cluster import MiniBatchKMeans
+
+    if preset == "fast":
+        from sklearn.decomposition import PCA
+        reducer = PCA(n_components=n_components, svd_solver="randomized", random_state=random_state)
+    elif preset == "fastest":
+        from sklearn.random_projection import GaussianRandomProjection
+        reducer = GaussianRandomProjection(n_components=n_components, random_state=random_state)
+    else:
+        raise ValueError(f"Unknown topic model preset {preset}, use one of {PRESETS}")
+
+    clusterer = MiniBatchKMeans(n_clusters=n_clusters, batch_size=4096, n_init=3, random_state=random_state)
+    return {"umap_model": reducer, "hdbscan_model": clusterer}
+
+
+def sample_indices(n, sample_size, seed=0):
+    """Returns the sorted positions of a uniform random sample of `sample_size` out of `n` items,
+    or all positions when the sample wouldn't be smaller."""
+    if not sample_size or sample_size >= n:
+        return np.arange(n)
+    rng = np.random.RandomState(seed)
+    return np.sort(rng.choice(n, sample_size, replace=False))
+
+
+def stratified_sample_indices(metadata, sample_size, strata=STRATA, seed=0):
+    """Returns the sorted positions of a sample that keeps the proportions of every stratum.
+
+    Documents are grouped by the `strata` columns of `metadata` ("day" is the
+    day of created_utc). Every group gets its share of `sample_size`, rounded by
+    largest remainder, and at least one document, so small subreddits and quiet
+    days are still represented.
+
+    Args:
+        metadata (dataframe): one row per document, e.g. documents.extract_documents output
+        sample_size (int): documents to sample. if none or not smaller than the corpus, all of them.
+        strata (list of str, optional): columns to stratify by, missing ones are ignored. Defaults to STRATA.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        array of positions in `metadata`
+    """
+    n = len(metadata)
+    if not sample_size or sample_size >= n:
+        return np.arange(n)
+
+    keys = {}
+    for column in strata:
+        if column == "day" and "created_utc" in metadata.columns:
+            keys[column] = pd.to_datetime(metadata["created_utc"]).dt.floor("D").to_numpy()
+        elif column in metadata.columns:
+            keys[column] = metadata[column].to_numpy()
+    if not keys:
+        return sample_indices(n, sample_size, seed)
+
+    groups = pd.DataFrame(keys).groupby(list(keys), sort=False, dropna=False).ngroup().to_numpy()
+    sizes = np.bincount(groups)
+
+    exact = sizes * sample_size / n
+    quotas = np.floor(exact).astype(np.int64)
+    remainder = sample_size - quotas.sum()
+    if remainder > 0:
+        quotas[np.argsort(quotas - exact, kind="stable")[:remainder]] += 1
+    quotas = np.minimum(np.maximum(quotas, 1), sizes)
+
+    # the first `quota` documents of every group, in a random order
+    rng = np.random.RandomState(seed)
+    order = rng.permutation(n)
+    shuffled_groups = groups[order]
+    by_group = np.argsort(shuffled_groups, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[by_group] = np.arange(n) - np.repeat(starts, sizes)
+
+    return np.sort(order[ranks < quotas[shuffled_groups]])
+
+
+def topic_agreement(reference, topics):
+    """How well `topics` reproduce the `reference` topics of the same documents.
+
+    Returns:
+        dictionary with the adjusted rand index and the normalized mutual information, both 1 for identical partitions
+    """
+    from sklearn.metrics import adjusted_rand_score, normalized_mutual_info_score
+
+    return {
+        "ari": adjusted_rand_score(reference, topics),
+        "nmi": normalized_mutual_info_score(reference, topics),
+    }
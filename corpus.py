@@ -0,0 +1,190 @@
+import os
+import json
+import sqlite3
+import threading
+
+import pandas as pd
+
+from schema import SCHEMA, apply_schema
+
+
+# columns produced by Reddit.clean_df, created_utc is derived from created_utc_unix on load
+COLUMNS = [
+    "id",
+    "title",
+    "score",
+    "subreddit",
+    "url",
+    "num_comments",
+    "body",
+    "created_utc_unix",
+    "keyword",
+    "is_comment",
+]
+
+
+class Corpus:
+    def __init__(self, path):
+        """Local store of everything scraped so far.
+
+        Records are kept per (keyword, subreddit filter, kind, query filters)
+        together with the time ranges that were fully fetched for them, so a
+        new scrape only needs to request the gaps and can serve the rest from
+        disk. Records fetched with query filters (see Reddit.create_url) never
+        stand in for unfiltered ones, or for ones filtered differently.
+
+        Args:
+            path (str): sqlite database file, created if it doesn't exist
+        """
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.create_tables()
+
+
+    def create_tables(self):
+        columns = ", ".join(c for c in COLUMNS if c != "id")
+        with self._lock, self.connection:
+            self.connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS records (
+                    query_keyword TEXT NOT NULL,
+                    query_subreddit TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    {columns},
+                    PRIMARY KEY (query_keyword, query_subreddit, kind, id)
+                )
+            """)
+            self.connection.execute("""
+                CREATE INDEX IF NOT EXISTS records_by_time
+                ON records (query_keyword, query_subreddit, kind, created_utc_unix)
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS coverage (
+                    query_keyword TEXT NOT NULL,
+                    query_subreddit TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    range_start INTEGER NOT NULL,
+                    range_end INTEGER NOT NULL
+                )
+            """)
+
+
+    @staticmethod
+    def scope(keyword, subreddit, comment, filters=None):
+        # the filters go into the keyword column, so databases of earlier versions keep working
+        active = {key: value for key, value in (filters or {}).items() if value not in (None, False)}
+        if active:
+            keyword = f"{keyword} {json.dumps(active, sort_keys=True, separators=(',', ':'))}"
+        return keyword, subreddit or "", "comments" if comment else "posts"
+
+
+    def covered_ranges(self, keyword, subreddit, comment, filters=None):
+        """Returns the [start, end) unix time ranges already fetched, sorted and merged."""
+        with self._lock:
+            rows = self.connection.execute(
+                """SELECT range_start, range_end FROM coverage
+                WHERE query_keyword = ? AND query_subreddit = ? AND kind = ?
+                ORDER BY range_start""",
+                Corpus.scope(keyword, subreddit, comment, filters)).fetchall()
+
+        merged = []
+        for start, end in rows:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return [tuple(r) for r in merged]
+
+
+    def missing_ranges(self, keyword, subreddit, comment, start, end, filters=None):
+        """Returns the parts of [start, end) that were never fetched.
+
+        Args:
+            keyword (string): keyword the search is based on
+            subreddit (str): subreddit filter of the search, None for all subreddits
+            comment (boolean): main posts or comments
+            start (int): start of the requested range in unix time
+            end (int): end of the requested range in unix time
+            filters (dict, optional): query filters of the search. Defaults to none.
+
+        Returns:
+            list of (start, end) tuples in unix time
+        """
+        gaps = []
+        cursor = start
+        for covered_start, covered_end in self.covered_ranges(keyword, subreddit, comment, filters):
+            if covered_end <= cursor:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start))
+            cursor = max(cursor, covered_end)
+
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+
+    def add(self, keyword, subreddit, comment, df, start, end, filters=None):
+        """Stores the records fetched for [start, end) and marks the range as covered.
+
+        Args:
+            keyword (string): keyword the search is based on
+            subreddit (str): subreddit filter of the search, None for all subreddits
+            comment (boolean): main posts or comments
+            df (dataframe): records returned by Reddit for the range
+            start (int): start of the fetched range in unix time
+            end (int): end of the fetched range in unix time
+            filters (dict, optional): query filters of the search. Defaults to none.
+        """
+        scope = Corpus.scope(keyword, subreddit, comment, filters)
+
+        rows = []
+        if not df.empty:
+            # Series.tolist gives python scalars, which is what sqlite can bind
+            columns = [df[c].tolist() if c in df.columns else [None] * len(df) for c in COLUMNS]
+            rows = [scope + values for values in zip(*columns)]
+
+        columns = ", ".join(COLUMNS)
+        placeholders = ", ".join("?" * (len(COLUMNS) + 3))
+        with self._lock, self.connection:
+            self.connection.executemany(
+                f"""INSERT OR REPLACE INTO records
+                (query_keyword, query_subreddit, kind, {columns})
+                VALUES ({placeholders})""",
+                rows)
+            if end > start:
+                self.connection.execute(
+                    "INSERT INTO coverage VALUES (?, ?, ?, ?, ?)",
+                    scope + (start, end))
+
+
+    def load(self, keyword, subreddit, comment, start, end, filters=None):
+        """Reads the stored records created in [start, end).
+
+        Returns:
+            dataframe with the same columns as Reddit.posts
+        """
+        columns = ", ".join(COLUMNS)
+        with self._lock:
+            df = pd.read_sql_query(
+                f"""SELECT {columns} FROM records
+                WHERE query_keyword = ? AND query_subreddit = ? AND kind = ?
+                AND created_utc_unix >= ? AND created_utc_unix < ?
+                ORDER BY created_utc_unix""",
+                self.connection,
+                params=Corpus.scope(keyword, subreddit, comment, filters) + (start, end))
+
+        if df.empty:
+            return pd.DataFrame()
+
+        df["created_utc"] = df["created_utc_unix"]
+        return apply_schema(df[list(SCHEMA)])
+
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,104 @@
+import re
+import zlib
+import hashlib
+
+import numpy as np
+
+
+# modulus of the minhash permutations, small enough for a * hash + b to fit in 64 bits
+PRIME = (1 << 31) - 1
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize(text):
+    return " ".join(WORD_PATTERN.findall(text.lower()))
+
+
+def shingles(text, size):
+    """Hashes of the overlapping `size`-word windows of a normalized text."""
+    words = text.split(" ")
+    if len(words) <= size:
+        return np.array([zlib.crc32(text.encode("utf-8"))], dtype=np.uint64)
+    return np.array(
+        [zlib.crc32(" ".join(words[n:n + size]).encode("utf-8")) for n in range(len(words) - size + 1)],
+        dtype=np.uint64)
+
+
+def minhash(texts, num_perm=64, shingle_size=3, seed=0):
+    """MinHash signature of every text, one row of `num_perm` values per text."""
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, PRIME, size=(num_perm, 1), dtype=np.uint64)
+    b = rng.randint(0, PRIME, size=(num_perm, 1), dtype=np.uint64)
+
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    for n, text in enumerate(texts):
+        hashes = shingles(text, shingle_size)
+        signatures[n] = ((a * (hashes[None, :] % PRIME) + b) % PRIME).min(axis=1)
+    return signatures
+
+
+class UnionFind:
+    def __init__(self, n):
+        self.parent = np.arange(n)
+
+    def find(self, x):
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, x, y):
+        x, y = self.find(x), self.find(y)
+        if x != y:
+            # the earlier document stays the representative
+            self.parent[max(x, y)] = min(x, y)
+
+
+def deduplicate(texts, threshold=0.8, num_perm=64, bands=16, shingle_size=3):
+    """Groups exact and near-duplicate texts.
+
+    Exact duplicates (after lowercasing and dropping punctuation) are found by
+    hashing. The remaining texts get a MinHash signature; locality sensitive
+    hashing over `bands` slices of it proposes candidate pairs, which are
+    merged when their estimated Jaccard similarity reaches `threshold`.
+
+    Args:
+        texts (list of str): documents
+        threshold (float, optional): minimum word-shingle Jaccard similarity of near duplicates. Defaults to 0.8.
+        num_perm (int, optional): minhash signature length. Defaults to 64.
+        bands (int, optional): LSH bands, must divide num_perm. Defaults to 16.
+        shingle_size (int, optional): words per shingle. Defaults to 3.
+
+    Returns:
+        tuple of the indices of one representative text per group, and for every
+        text the position of its group's representative in that list
+    """
+    normalized = [normalize(text) for text in texts]
+
+    # exact duplicates
+    first_seen = {}
+    exact = np.empty(len(texts), dtype=np.int64)
+    for n, text in enumerate(normalized):
+        key = hashlib.sha1(text.encode("utf-8")).digest()
+        exact[n] = first_seen.setdefault(key, n)
+    unique = np.unique(exact)
+
+    # near duplicates among the exact-unique texts
+    groups = UnionFind(len(unique))
+    if threshold < 1 and len(unique) > 1:
+        signatures = minhash([normalized[n] for n in unique], num_perm, shingle_size)
+        rows = num_perm // bands
+        for band in range(bands):
+            buckets = {}
+            for n, key in enumerate(map(bytes, signatures[:, band * rows:(band + 1) * rows])):
+                other = buckets.setdefault(key, n)
+                if other != n and (signatures[n] == signatures[other]).mean() >= threshold:
+                    groups.union(other, n)
+
+    roots = np.array([groups.find(n) for n in range(len(unique))])
+    representatives, positions = np.unique(unique[roots], return_inverse=True)
+
+    labels = positions[np.searchsorted(unique, exact)]
+    return representatives.tolist(), labels
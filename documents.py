@@ -0,0 +1,116 @@
+import re
+
+import pandas as pd
+
+
+# columns of the scrape output the documents are built from
+SOURCE_COLUMNS = ["id", "title", "body", "subreddit", "keyword", "is_comment", "created_utc_unix"]
+TEXT_FIELDS = ["title", "body"]
+
+REMOVED = ["[deleted]", "[removed]"]
+URL_PATTERN = re.compile(r"https?://\S+|www\.\S+")
+
+
+def read_chunks(filepath, chunksize):
+    """Yields a scrape output file as dataframes of at most `chunksize` rows, reading only SOURCE_COLUMNS."""
+    if filepath.endswith(".csv"):
+        yield from pd.read_csv(
+            filepath,
+            usecols=lambda c: c in SOURCE_COLUMNS,
+            dtype={"id": str, "title": str, "body": str},
+            chunksize=chunksize)
+
+    elif ".jsonl" in filepath:
+        yield from pd.read_json(filepath, orient="records", lines=True, dtype=False, chunksize=chunksize)
+
+    elif filepath.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(filepath)
+        columns = [c for c in parquet_file.schema_arrow.names if c in SOURCE_COLUMNS]
+        for batch in parquet_file.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+
+    else:
+        # pickle and json can't be read partially
+        from writers import read_output
+
+        df = read_output(filepath)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start + chunksize]
+
+
+def extract(chunk, source, drop_removed=False, strip_urls=False, normalize=False, min_length=1):
+    """Turns scraped records into documents, one per non-empty title and body.
+
+    Args:
+        chunk (dataframe): scraped records
+        source (str): file the records come from
+        drop_removed (bool, optional): skip [deleted] and [removed] texts. Defaults to False.
+        strip_urls (bool, optional): remove links from the texts. Defaults to False.
+        normalize (bool, optional): collapse whitespace and trim the texts. Defaults to False.
+        min_length (int, optional): skip texts shorter than this many characters. Defaults to 1.
+
+    Returns:
+        dataframe with the text of every document and the record it comes from
+    """
+    frames = []
+    for field in TEXT_FIELDS:
+        if field not in chunk.columns:
+            continue
+
+        # missing values come back as NaN/None
+        text = chunk[field].dropna().astype(str)
+
+        if drop_removed:
+            text = text[~text.isin(REMOVED)]
+        if strip_urls:
+            text = text.str.replace(URL_PATTERN, "", regex=True)
+        if normalize:
+            text = text.str.replace(r"\s+", " ", regex=True).str.strip()
+        text = text[text.str.len() >= max(min_length, 1)]
+
+        docs = pd.DataFrame({"text": text, "field": field}, index=text.index)
+        for column in ["id", "subreddit", "keyword", "is_comment"]:
+            if column in chunk.columns:
+                docs[column] = chunk.loc[text.index, column]
+        if "created_utc_unix" in chunk.columns:
+            docs["created_utc"] = pd.to_datetime(chunk.loc[text.index, "created_utc_unix"], unit="s")
+        docs["source"] = source
+        frames.append(docs)
+
+    if not frames:
+        # an empty scrape has no title/body columns
+        return pd.DataFrame(columns=["text", "field", "source"])
+
+    # titles come before the body of the same record, like in the scraped data
+    return pd.concat(frames).sort_index(kind="stable").reset_index(drop=True)
+
+
+def iter_documents(files, chunksize=50000, **filters):
+    """Streams the documents of scrape output files chunk by chunk, so memory stays bounded.
+
+    Args:
+        files (list of str): scrape output files in any supported format
+        chunksize (int, optional): records read at a time. Defaults to 50000.
+        **filters: passed to extract
+
+    Yields:
+        dataframes of documents, see extract
+    """
+    for filepath in files:
+        try:
+            chunks = read_chunks(filepath, chunksize)
+            for chunk in chunks:
+                yield extract(chunk, filepath, **filters)
+        except pd.errors.EmptyDataError:
+            # Empty file. No scrape results.
+            continue
+
+
+def extract_documents(files, chunksize=50000, **filters):
+    """Reads the documents of scrape output files into one dataframe, see iter_documents."""
+    frames = [docs for docs in iter_documents(files, chunksize, **filters) if not docs.empty]
+    if not frames:
+        return pd.DataFrame(columns=["text", "field", "source"])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+
+import numpy as np
+
+from metrics import METRICS
+from checkpoint import write_atomic
+
+
+# below this many documents per worker, starting processes costs more than it saves
+MIN_DOCS_PER_PROCESS = 5000
+
+
+class Embedder:
+    def __init__(self, model_name, batch_size=64, processes=None, quantize=False):
+        """CPU embedding stage handing precomputed embeddings to BERTopic.
+
+        Documents are sorted by length before batching so every batch holds
+        documents of similar length and little compute is spent on padding.
+        Large inputs are spread over a pool of worker processes.
+
+        Args:
+            model_name (str): sentence-transformers model name
+            batch_size (int, optional): documents per forward pass. Defaults to 64.
+            processes (int, optional): worker processes. if none, one per core for large inputs, a single one otherwise.
+            quantize (bool, optional): run the model with dynamic int8 quantization of its linear layers. Defaults to False.
+        """
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.processes = processes
+        self.quantize = quantize
+        self._model = None
+
+
+    @property
+    def model(self):
+        """The SentenceTransformer, loaded on first use."""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer(self.model_name, device="cpu")
+            if self.quantize:
+                import torch
+                model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self._model = model
+        return self._model
+
+
+    @property
+    def version(self):
+        """Identifies the embeddings this embedder produces, for EmbeddingCache."""
+        import sentence_transformers
+        return f"{sentence_transformers.__version__}{'-int8' if self.quantize else ''}"
+
+
+    def encode(self, docs):
+        """Embeds documents.
+
+        Args:
+            docs (list of str): documents to embed
+
+        Returns:
+            float32 array with one row per document, in the order of `docs`
+        """
+        if not docs:
+            return np.empty((0, 0), dtype=np.float32)
+
+        order = np.argsort([len(doc) for doc in docs], kind="stable")
+        sorted_docs = [docs[n] for n in order]
+
+        processes = self.processes
+        if processes is None:
+            processes = min(os.cpu_count() or 1, len(docs) // MIN_DOCS_PER_PROCESS) or 1
+
+        start = time.time()
+        if processes > 1:
+            pool = self.model.start_multi_process_pool(target_devices=["cpu"] * processes)
+            try:
+                embeddings = self.model.encode_multi_process(sorted_docs, pool, batch_size=self.batch_size)
+            finally:
+                self.model.stop_multi_process_pool(pool)
+        else:
+            embeddings = self.model.encode(
+                sorted_docs, batch_size=self.batch_size, show_progress_bar=True, convert_to_numpy=True)
+
+        elapsed = time.time() - start
+        METRICS.count("embedded_documents_total", len(docs))
+        print(f"Embedded {len(docs)} documents in {elapsed:.1f}s ({len(docs) / max(elapsed, 1e-9):.0f} docs/sec, {processes} processes)")
+
+        result = np.empty(embeddings.shape, dtype=np.float32)
+        result[order] = embeddings
+        return result
+
+
+class EmbeddingCache:
+    def __init__(self, directory, model_name, model_version, max_bytes=None):
+        """Embeddings of previously seen documents, keyed by a hash of their text.
+
+        Every batch of new embeddings is written as one shard: a float32 .npy file
+        that is memory-mapped on read, plus the sha1 hex digests of its documents.
+        The cache belongs to one embedding model and version, and is wiped when
+        either changes. When the shards grow over `max_bytes`, the least recently
+        used ones are deleted.
+
+        Args:
+            directory (str): root folder of the cache
+            model_name (str): name of the embedding model
+            model_version (str): anything that changes when the model's output would change
+            max_bytes (int, optional): size limit of the cache on disk. if none, the cache is never evicted.
+        """
+        self.directory = os.path.join(directory, model_name.replace("/", "__"))
+        self.manifest_file = os.path.join(self.directory, "manifest.json")
+        self.model_name = model_name
+        self.model_version = model_version
+        self.max_bytes = max_bytes
+
+        self.manifest = self.read_manifest()
+        self.index = self.build_index()
+
+
+    def read_manifest(self):
+        if os.path.isfile(self.manifest_file):
+            with open(self.manifest_file) as f:
+                manifest = json.load(f)
+            if manifest["model"] == self.model_name and manifest["version"] == self.model_version:
+                return manifest
+
+            print(f"Embedding model changed, clearing {self.directory}")
+            shutil.rmtree(self.directory)
+
+        return {"model": self.model_name, "version": self.model_version, "shards": []}
+
+
+    def write_manifest(self):
+        def dump(path):
+            with open(path, "w") as f:
+                json.dump(self.manifest, f)
+
+        os.makedirs(self.directory, exist_ok=True)
+        write_atomic(self.manifest_file, dump)
+
+
+    def build_index(self):
+        """Maps every cached digest to its (shard, row)."""
+        index = {}
+        for shard in self.manifest["shards"]:
+            keys = np.load(os.path.join(self.directory, shard["keys"]))
+            for row, key in enumerate(keys.tolist()):
+                index[key] = (shard["name"], row)
+        return index
+
+
+    @staticmethod
+    def digest(doc):
+        return hashlib.sha1(doc.encode("utf-8")).hexdigest()
+
+
+    def encode(self, docs, encode_fn):
+        """Returns the embeddings of `docs`, only calling `encode_fn` for documents not in the cache.
+
+        Args:
+            docs (list of str): documents to embed
+            encode_fn (callable): takes a list of documents and returns a 2d array of embeddings
+
+        Returns:
+            float32 array with one row per document
+        """
+        keys = [EmbeddingCache.digest(doc) for doc in docs]
+
+        missing = {}
+        for n, key in enumerate(keys):
+            if key not in self.index and key not in missing:
+                missing[key] = n
+
+        METRICS.count("embedding_cache_misses_total", len(missing))
+        METRICS.count("embedding_cache_hits_total", len(docs) - len(missing))
+        print(f"Embedding cache: {len(missing)} of {len(docs)} documents need embedding")
+        if missing:
+            new_embeddings = np.asarray(encode_fn([docs[n] for n in missing.values()]), dtype=np.float32)
+            self.add(list(missing.keys()), new_embeddings)
+
+        embeddings = self.get(keys)
+
+        # evicting only after the read, so shards this call needs can't disappear under it
+        self.evict()
+        self.write_manifest()
+        return embeddings
+
+
+    def add(self, keys, embeddings):
+        """Writes a new shard holding `embeddings`, one row per key."""
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"shard-{int(time.time() * 1000)}-{len(self.manifest['shards']):05d}"
+        shard = {
+            "name": f"{name}.npy",
+            "keys": f"{name}.keys.npy",
+            "rows": len(keys),
+            "bytes": int(embeddings.nbytes),
+            "last_used": time.time(),
+        }
+
+        np.save(os.path.join(self.directory, shard["name"]), embeddings)
+        np.save(os.path.join(self.directory, shard["keys"]), np.array(keys, dtype="U40"))
+
+        self.manifest["shards"].append(shard)
+        for row, key in enumerate(keys):
+            self.index[key] = (shard["name"], row)
+
+        self.write_manifest()
+
+
+    def get(self, keys):
+        """Gathers the cached embeddings of `keys`, which must all be in the cache."""
+        rows_by_shard = {}
+        for n, key in enumerate(keys):
+            name, row = self.index[key]
+            rows_by_shard.setdefault(name, ([], []))
+            rows_by_shard[name][0].append(n)
+            rows_by_shard[name][1].append(row)
+
+        result = None
+        now = time.time()
+        for shard in self.manifest["shards"]:
+            if shard["name"] not in rows_by_shard:
+                continue
+
+            positions, rows = rows_by_shard[shard["name"]]
+            embeddings = np.load(os.path.join(self.directory, shard["name"]), mmap_mode="r")
+            if result is None:
+                result = np.empty((len(keys), embeddings.shape[1]), dtype=np.float32)
+            result[positions] = embeddings[rows]
+            shard["last_used"] = now
+
+        return result if result is not None else np.empty((0, 0), dtype=np.float32)
+
+
+    def evict(self):
+        """Deletes the least recently used shards until the cache fits in max_bytes."""
+        if not self.max_bytes:
+            return
+
+        total = sum(shard["bytes"] for shard in self.manifest["shards"])
+        for shard in sorted(self.manifest["shards"], key=lambda s: s["last_used"]):
+            if total <= self.max_bytes:
+                break
+
+            for f in [shard["name"], shard["keys"]]:
+                os.remove(os.path.join(self.directory, f))
+            self.manifest["shards"].remove(shard)
+            total -= shard["bytes"]
+
+        names = {shard["name"] for shard in self.manifest["shards"]}
+        self.index = {key: value for key, value in self.index.items() if value[0] in names}
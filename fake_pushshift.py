@@ -0,0 +1,296 @@
+import json
+import gzip
+import time
+import random
+import calendar
+import threading
+from datetime import datetime
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+SUBREDDITS = ["news", "worldnews", "science", "environment", "politics", "askreddit"]
+
+# a few word clusters, so the synthetic corpus has topics to find
+TOPIC_WORDS = [
+    ["drought", "rain", "river", "reservoir", "irrigation", "farmers", "aquifer", "wells"],
+    ["price", "market", "stock", "inflation", "bank", "rates", "economy", "investors"],
+    ["election", "senate", "vote", "bill", "governor", "campaign", "policy", "court"],
+    ["climate", "emissions", "carbon", "heat", "wildfire", "warming", "ice", "solar"],
+    ["game", "team", "season", "coach", "playoffs", "score", "league", "fans"],
+]
+FILLER_WORDS = ["the", "a", "of", "and", "to", "in", "is", "that", "it", "for", "this", "with", "on", "was", "i", "you"]
+
+# fields that can be filtered on with query parameters like score=>10 or author=![deleted]
+FILTER_FIELDS = ["score", "num_comments", "author"]
+
+
+def matches(value, condition):
+    """Whether a record field passes a pushshift filter condition."""
+    if condition.startswith("!"):
+        return value != condition[1:]
+    if value is None:
+        return False
+    if condition.startswith(">"):
+        return value > float(condition[1:])
+    if condition.startswith("<"):
+        return value < float(condition[1:])
+    return str(value) == condition
+
+
+class FakePushshift:
+    def __init__(self, start_date="2022-03-01", end_date="2022-04-01", posts_per_day=1000, comments_per_day=3000,
+                 subreddits=SUBREDDITS, latency=0.0, requests_per_second=None, error_rate=0.0, seed=0, max_size=1000):
+        """Local stand-in for the pushshift search API, for offline runs and benchmarks.
+
+        Serves /reddit/search/submission/ and /reddit/comment/search/ with
+        synthetic records spread evenly over [start_date, end_date), in
+        ascending created_utc order like the cursor in Reddit.get_dates
+        expects. Records are generated on request from their index, so any
+        corpus size costs no memory. Every record mentions the queried
+        keyword, or one or two terms of an OR query like `a|"b c"`; bodies
+        have long-tailed lengths and about a third of the submissions have
+        no selftext.
+
+        Args:
+            start_date (str, optional): first day with records, YYYY-MM-DD. Defaults to "2022-03-01".
+            end_date (str, optional): day after the last one with records. Defaults to "2022-04-01".
+            posts_per_day (int, optional): submissions per day, at most 86400. Defaults to 1000.
+            comments_per_day (int, optional): comments per day, at most 86400. Defaults to 3000.
+            subreddits (list of str, optional): subreddits the records are spread over. Defaults to SUBREDDITS.
+            latency (float, optional): seconds added to every response. Defaults to 0.
+            requests_per_second (float, optional): answer 429 above this rate. if none, there is no rate limit.
+            error_rate (float, optional): fraction of requests answered with a 502. Defaults to 0.
+            seed (int, optional): random seed of the generated text and errors. Defaults to 0.
+            max_size (int, optional): largest page size accepted, larger ones are answered with a 400. Defaults to 1000.
+        """
+        self.start = calendar.timegm(datetime.strptime(start_date, "%Y-%m-%d").timetuple())
+        self.days = (calendar.timegm(datetime.strptime(end_date, "%Y-%m-%d").timetuple()) - self.start) // 86400
+        self.per_day = {"submission": min(posts_per_day, 86400), "comment": min(comments_per_day, 86400)}
+        self.subreddits = subreddits
+        self.latency = latency
+        self.requests_per_second = requests_per_second
+        self.error_rate = error_rate
+        self.seed = seed
+        self.max_size = max_size
+
+        self.stats = {"requests": 0, "pages": 0, "rows": 0, "bytes": 0, "throttled": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._tokens = 1.0
+        self._last_request = time.monotonic()
+        self.server = None
+
+
+    def total(self, kind):
+        return self.days * self.per_day[kind]
+
+
+    def created_utc(self, kind, n):
+        return self.start + n * 86400 // self.per_day[kind]
+
+
+    def first_after(self, kind, after):
+        """Index of the first record created strictly after `after`."""
+        per_day = self.per_day[kind]
+        return max(0, -(-(after + 1 - self.start) * per_day // 86400))
+
+
+    def record(self, kind, n, keyword):
+        rng = random.Random(self.seed * 1000003 + n * 2 + (kind == "comment"))
+        words = TOPIC_WORDS[rng.randrange(len(TOPIC_WORDS))]
+        # a record of an OR query mentions one or two of its terms
+        terms = [term.strip('"') for term in keyword.split("|")]
+        if len(terms) > 1:
+            terms = rng.sample(terms, rng.choice([1, 1, 1, 2]))
+
+        def text(mean_words):
+            length = max(1, int(rng.lognormvariate(0, 1) * mean_words))
+            tokens = [rng.choice(words) if rng.random() < 0.3 else rng.choice(FILLER_WORDS) for _ in range(length)]
+            for term in terms:
+                tokens.insert(rng.randrange(len(tokens) + 1), term)
+            return " ".join(tokens)
+
+        record = {
+            "id": f"{'c' if kind == 'comment' else 's'}{n:x}",
+            "created_utc": self.created_utc(kind, n),
+            "subreddit": self.subreddits[n % len(self.subreddits)],
+            "author": "[deleted]" if rng.random() < 0.05 else f"user{rng.randrange(100000)}",
+            "score": int(rng.paretovariate(1.5)) - 1,
+        }
+        if kind == "comment":
+            record["body"] = text(25)
+            record["link_id"] = f"t3_s{rng.randrange(max(n, 1)):x}"
+        else:
+            record["title"] = text(8)
+            record["selftext"] = text(60) if rng.random() > 0.35 else ""
+            record["url"] = f"https://www.reddit.com/r/{record['subreddit']}/comments/s{n:x}/"
+            record["num_comments"] = int(rng.paretovariate(1.2)) - 1
+        return record
+
+
+    def search(self, kind, keyword="", after=0, before=None, size=100, subreddit=None, fields=None, filters=None):
+        """Returns the page of records a pushshift search with these parameters would.
+        `filters` maps record fields to pushshift conditions like ">10", "<5", "7" or "![deleted]".
+        """
+        total = self.total(kind)
+        if before is None:
+            end = total
+        else:
+            end = min(total, max(0, -(-(before - self.start) * self.per_day[kind] // 86400)))
+
+        n = self.first_after(kind, after)
+        step = 1
+        if subreddit:
+            if subreddit not in self.subreddits:
+                return []
+            # records go round-robin over the subreddits
+            offset = self.subreddits.index(subreddit)
+            n += (offset - n) % len(self.subreddits)
+            step = len(self.subreddits)
+
+        records = []
+        while n < end and len(records) < size:
+            record = self.record(kind, n, keyword)
+            if filters and not all(matches(record.get(key), condition) for key, condition in filters.items()):
+                n += step
+                continue
+            if fields:
+                record = {key: value for key, value in record.items() if key in fields}
+            records.append(record)
+            n += step
+        return records
+
+
+    def admit(self):
+        """Decides the fate of a request: None to serve it, or the (status, headers) to answer instead."""
+        with self._lock:
+            self.stats["requests"] += 1
+
+            if self.requests_per_second:
+                now = time.monotonic()
+                self._tokens = min(1.0, self._tokens + (now - self._last_request) * self.requests_per_second)
+                self._last_request = now
+                if self._tokens < 1.0:
+                    self.stats["throttled"] += 1
+                    wait = (1.0 - self._tokens) / self.requests_per_second
+                    return 429, {"Retry-After": f"{wait:.3f}", "X-RateLimit-Remaining": "0", "X-RateLimit-Reset": f"{wait:.3f}"}
+                self._tokens -= 1.0
+
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.stats["errors"] += 1
+                return 502, {}
+        return None
+
+
+    def handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                url = urlparse(self.path)
+                if url.path.rstrip("/") == "/reddit/search/submission":
+                    kind = "submission"
+                elif url.path.rstrip("/") == "/reddit/comment/search":
+                    kind = "comment"
+                else:
+                    return self.respond(404, b'{"detail": "Not Found"}')
+
+                refused = fake.admit()
+                if refused:
+                    status, headers = refused
+                    return self.respond(status, b"{}", headers)
+
+                q = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if int(q.get("size", 100)) > fake.max_size:
+                    return self.respond(400, json.dumps({"detail": f"size must be at most {fake.max_size}"}).encode("utf-8"))
+
+                records = fake.search(
+                    kind,
+                    keyword=q.get("q", ""),
+                    after=int(q.get("after", 0)),
+                    before=int(q["before"]) if "before" in q else None,
+                    size=int(q.get("size", 100)),
+                    subreddit=q.get("subreddit"),
+                    fields=q["fields"].split(",") if "fields" in q else None,
+                    filters={key: q[key] for key in FILTER_FIELDS if key in q})
+                body = json.dumps({"data": records}).encode("utf-8")
+
+                with fake._lock:
+                    fake.stats["pages"] += 1
+                    fake.stats["rows"] += len(records)
+                    fake.stats["bytes"] += len(body)
+
+                headers = {}
+                if "gzip" in self.headers.get("Accept-Encoding", ""):
+                    body = gzip.compress(body, compresslevel=1)
+                    headers["Content-Encoding"] = "gzip"
+                self.respond(200, body, headers)
+
+            def respond(self, status, body, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # one line per request would drown the scraper's own output
+                pass
+
+        return Handler
+
+
+    def serve(self, host="127.0.0.1", port=0):
+        """Starts serving in a background thread.
+
+        Returns:
+            str: the base url to use as api_url
+        """
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="fake-pushshift", daemon=True).start()
+        return f"http://{host}:{self.server.server_address[1]}"
+
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a fake pushshift API with synthetic records.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--start-date", default="2022-03-01")
+    parser.add_argument("--end-date", default="2022-04-01")
+    parser.add_argument("--posts-per-day", type=int, default=1000)
+    parser.add_argument("--comments-per-day", type=int, default=3000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--requests-per-second", type=float, help="answer 429 above this rate")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 502")
+    parser.add_argument("--max-size", type=int, default=1000, help="largest page size accepted")
+    args = parser.parse_args()
+
+    fake = FakePushshift(
+        args.start_date, args.end_date, args.posts_per_day, args.comments_per_day,
+        latency=args.latency, requests_per_second=args.requests_per_second, error_rate=args.error_rate,
+        max_size=args.max_size)
+    url = fake.serve(port=args.port)
+    print(f"Fake pushshift API on {url}, set \"api_url\": \"{url}\" in config.json")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        fake.stop()
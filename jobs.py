@@ -0,0 +1,66 @@
+import time
+import threading
+import traceback
+
+
+class Job:
+    def __init__(self, name, target, *args, **kwargs):
+        """Runs `target` in a background thread and keeps track of its progress.
+
+        `target` is called with a `progress(fraction, message)` callback as its
+        first argument, followed by `args` and `kwargs`. The job never touches
+        the UI itself: the page reads `fraction`, `message`, `result` and
+        `error` on every rerun, so a long scrape doesn't freeze the app.
+
+        Args:
+            name (str): shown while the job runs
+            target (callable): the work to do
+        """
+        self.name = name
+        self.target = target
+        self.args = args
+        self.kwargs = kwargs
+
+        self.fraction = 0.0
+        self.message = "Waiting to start"
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        self._thread = threading.Thread(target=self.run, name=f"job-{name}", daemon=True)
+
+
+    def start(self):
+        self.started = time.time()
+        self._thread.start()
+        return self
+
+
+    def run(self):
+        try:
+            self.result = self.target(self.progress, *self.args, **self.kwargs)
+            self.progress(1.0, "Done")
+        except Exception as e:
+            self.error = e
+            self.message = f"Failed: {e}"
+            traceback.print_exc()
+        finally:
+            self.finished = time.time()
+
+
+    def progress(self, fraction, message=None):
+        self.fraction = min(max(fraction, 0.0), 1.0)
+        if message:
+            self.message = message
+
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
@@ -0,0 +1,126 @@
+import re
+import hashlib
+
+from schema import apply_schema
+from metrics import METRICS
+
+
+# characters of one OR query, below the length pushshift accepts in the q parameter
+MAX_QUERY_LENGTH = 500
+
+
+def keyword_query(keywords):
+    """Pushshift query matching any of `keywords`, phrases quoted, e.g. `"climate change"|drought`."""
+    return "|".join(f'"{keyword}"' if " " in keyword else keyword for keyword in keywords)
+
+
+def keyword_batches(keywords, max_length=MAX_QUERY_LENGTH):
+    """Packs keywords into as few OR queries as fit in `max_length` characters each.
+
+    Keywords are sorted first, so the same keywords always give the same
+    batches and the checkpoints of a batch can be resumed.
+
+    Args:
+        keywords (list of str): keywords to search for
+        max_length (int, optional): longest query. Defaults to MAX_QUERY_LENGTH.
+
+    Returns:
+        list of lists of keywords, one per query
+    """
+    batches = []
+    batch = []
+    for keyword in sorted(keywords):
+        if batch and len(keyword_query(batch + [keyword])) > max_length:
+            batches.append(batch)
+            batch = []
+        batch.append(keyword)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def batch_name(query):
+    """Short name of a query that is safe in file names."""
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()[:10]
+
+
+class KeywordMatcher:
+    def __init__(self, keywords):
+        """Finds which keywords a record mentions, to split the results of an OR query by keyword.
+
+        All keywords go into one case-insensitive regular expression matching
+        whole words (phrases may span any whitespace), applied to the title and
+        body of every record in one vectorized pass. The expression finds one
+        keyword per position, so a keyword inside a longer matched phrase
+        ("climate" in "climate change") is added afterwards.
+
+        Args:
+            keywords (list of str): keywords of the query
+        """
+        self.keywords = list(keywords)
+
+        # longest first, so a phrase wins over a keyword it starts with
+        alternatives = [self.pattern(keyword) for keyword in sorted(self.keywords, key=len, reverse=True)]
+        self.regex = re.compile(r"(?<!\w)(?:" + "|".join(alternatives) + r")(?!\w)", re.IGNORECASE)
+
+        # a match is looked up by its lowercased, single-spaced text
+        self.matched_keywords = {}
+        for keyword in self.keywords:
+            contained = [
+                other for other in self.keywords
+                if re.search(r"(?<!\w)" + self.pattern(other) + r"(?!\w)", keyword, re.IGNORECASE)
+            ]
+            self.matched_keywords.setdefault(self.normalize(keyword), set()).update(contained)
+
+
+    @staticmethod
+    def pattern(keyword):
+        return r"\s+".join(re.escape(word) for word in keyword.split())
+
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.lower().split())
+
+
+    def match(self, texts):
+        """Returns the set of keywords every text mentions.
+
+        Args:
+            texts (series of str): texts to search
+
+        Returns:
+            series of sets of keywords
+        """
+        def keywords(matches):
+            found = set()
+            for match in set(matches):
+                found.update(self.matched_keywords.get(self.normalize(match), ()))
+            return found
+
+        return texts.fillna("").str.findall(self.regex).map(keywords)
+
+
+    def attribute(self, df):
+        """Splits the records of an OR query into one row per (record, keyword it mentions).
+        Records mentioning none of the keywords, e.g. through pushshift's own text analysis, are dropped.
+
+        Args:
+            df (dataframe): records from Reddit.pull_posts
+
+        Returns:
+            dataframe with the keyword column set to the matching keyword
+        """
+        if df.empty:
+            return df
+
+        texts = df["title"].fillna("").astype(str) + "\n" + df["body"].fillna("").astype(str)
+        matches = self.match(texts)
+
+        unmatched = int((matches.map(len) == 0).sum())
+        if unmatched:
+            METRICS.count("unattributed_records_total", unmatched)
+
+        attributed = df.assign(keyword=matches.map(sorted)).explode("keyword")
+        attributed = attributed[attributed["keyword"].notna()].reset_index(drop=True)
+        return apply_schema(attributed)
@@ -1,10 +1,20 @@
 
 import os
 import json
+import time
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
+from jobs import Job
+from scrape import Scrape
+from artifacts import latest_version
+from clustering import PRESETS
+from documents import extract_documents
+from schema import SCHEMA
+from writers import read_output
+
 
 def initialize_session_state():
     with open("config_default.json") as config_file:
@@ -34,11 +44,32 @@ def multiselect_with_addition(label1, label2, key_default, key_selections):
         )
 
 
-def save_config_file(config):
+def topic_model_settings(config):
+    """Lets the user pick how the topic model is fitted on the scraped documents."""
+    settings = dict(config.get("topic_model", {}))
+
+    settings["fit"] = st.checkbox("Fit a topic model on the scraped data", value=settings.get("fit", False))
+    settings["preset"] = st.selectbox(
+        "Clustering: 'fast' and 'fastest' scale to millions of documents",
+        options=PRESETS,
+        index=PRESETS.index(settings.get("preset", "default")))
+    if settings["preset"] != "default":
+        settings["n_clusters"] = st.number_input("Number of topics", min_value=2, value=settings.get("n_clusters", 50))
+    sample_size = st.number_input(
+        "Fit on a sample of this many documents (0 for all)", min_value=0, value=settings.get("sample_size") or 0, step=1000)
+    settings["sample_size"] = sample_size or None
+
+    st.session_state["topic_model"] = settings
+    return settings
+
+
+def save_config_file(config, path="config.json"):
     config["subreddits"] = st.session_state["subreddits_to_scrape"]
     config["keywords"] = list(set(st.session_state["keywords"]))
+    if "topic_model" in st.session_state:
+        config["topic_model"] = st.session_state["topic_model"]
 
-    with open("config.json", "w") as outfile:
+    with open(path, "w") as outfile:
         json.dump(config, outfile)
 
 
@@ -56,23 +87,235 @@ def save_config_file(config):
 
 
 def display_scraped_data_in_tables(output_files):
-    
+    filenames = {os.path.basename(path): path for path in output_files}
+
+    for filename in filenames.keys():
+        keyword = filename.split("_")[1]
+        st.markdown(f"**{keyword}**")
+        display_data_browser(filenames[filename], key=filename)
+
+
+@st.cache_resource(show_spinner="Reading scraped data...", max_entries=16)
+def load_output_file(signature):
+    """Reads a scrape output file once per version of the file.
+
+    Cached as a resource, so reruns share one frame instead of unpickling a
+    copy each time: callers must not modify it.
+
+    Args:
+        signature (tuple): path, size and modification time of the file, see files_signature
+    """
+    df = read_output(signature[0])
+    # csv files carry the index of the frame they were written from
+    return df[[c for c in df.columns if c in SCHEMA]]
+
+
+def filter_output(df, subreddits=None, start_date=None, end_date=None, min_score=None):
+    """Returns the records of `df` in `subreddits`, created between the two dates (inclusive) and scoring at least `min_score`."""
+    mask = np.ones(len(df), dtype=bool)
+    if subreddits and "subreddit" in df.columns:
+        mask &= df["subreddit"].isin(subreddits).to_numpy()
+    if start_date and "created_utc" in df.columns:
+        mask &= (df["created_utc"] >= pd.Timestamp(start_date)).to_numpy()
+    if end_date and "created_utc" in df.columns:
+        mask &= (df["created_utc"] < pd.Timestamp(end_date) + pd.Timedelta(days=1)).to_numpy()
+    if min_score is not None and "score" in df.columns:
+        mask &= (df["score"] >= min_score).to_numpy()
+    return df if mask.all() else df[mask]
+
+
+@st.cache_data(show_spinner="Preparing the download...", max_entries=4)
+def export_csv(signature, columns, filters):
+    df = filter_output(load_output_file(signature), **dict(filters))
+    return df[list(columns)].to_csv(index=False).encode("utf-8")
+
+
+def display_data_browser(output_file, key, page_sizes=(50, 100, 500, 1000)):
+    """Shows one page of a scrape output file at a time, filtered and projected on the server.
+
+    Args:
+        output_file (str): scrape output file in any supported format
+        key (str): unique prefix of the widget keys
+        page_sizes (tuple of int, optional): rows per page to choose from
+    """
+    signature = files_signature([output_file])
+    df = load_output_file(signature[0]) if signature else pd.DataFrame()
+    if df.empty:
+        st.write("No posts for this keyword.")
+        return
+
+    with st.expander("Filter"):
+        subreddits = []
+        if "subreddit" in df.columns:
+            subreddits = st.multiselect(
+                "Subreddits", options=sorted(df["subreddit"].dropna().unique().tolist()), key=f"{key}_subreddits")
+
+        dates = st.date_input(
+            "Created between",
+            value=(df["created_utc"].min().date(), df["created_utc"].max().date()),
+            key=f"{key}_dates")
+        # while picking a range, only its start is set
+        dates = list(dates) if isinstance(dates, (list, tuple)) else [dates]
+        start_date, end_date = (dates + [None, None])[:2]
+
+        min_score = st.number_input("Minimum score", value=int(df["score"].min()), step=1, key=f"{key}_score")
+        columns = st.multiselect("Columns", options=list(df.columns), default=list(df.columns), key=f"{key}_columns")
+
+    filters = (("subreddits", tuple(subreddits)), ("start_date", start_date), ("end_date", end_date), ("min_score", min_score))
+    filtered = filter_output(df, **dict(filters))
+    columns = columns or list(df.columns)
+
+    page_size = st.selectbox("Rows per page", options=page_sizes, index=1, key=f"{key}_page_size")
+    pages = max(1, -(-len(filtered) // page_size))
+    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, step=1, key=f"{key}_page")
+
+    start = (page - 1) * page_size
+    st.dataframe(filtered[columns].iloc[start:start + page_size])
+    st.caption(f"Rows {min(start + 1, len(filtered))}-{min(start + page_size, len(filtered))} of {len(filtered)} ({len(df)} scraped)")
+
+    # the csv is only generated once asked for, not on every rerun
+    if st.button("Prepare CSV download", key=f"{key}_prepare"):
+        st.session_state[f"{key}_export"] = (tuple(columns), filters)
+    if st.session_state.get(f"{key}_export") == (tuple(columns), filters):
+        st.download_button(
+            "Download CSV",
+            export_csv(signature[0], tuple(columns), filters),
+            f"{os.path.splitext(os.path.basename(output_file))[0]}.csv",
+            "text/csv",
+            key=f"{key}_download")
+
+
+def saved_topic_model_exists(name="batch"):
+    return latest_version(name) is not None
+
+
+def start_job(key, target, *args, **kwargs):
+    """Starts `target` as a background jobs.Job stored under `key`, unless one is still running there."""
+    jobs = st.session_state.setdefault("jobs", {})
+    if key in jobs and jobs[key].running:
+        return jobs[key]
+    jobs[key] = Job(key, target, *args, **kwargs).start()
+    return jobs[key]
+
+
+def display_job(key, poll_interval=1.0):
+    """Shows the progress of the job under `key`, rerunning the page until it finishes.
+
+    Returns:
+        the job, None if none was started
+    """
+    job = st.session_state.get("jobs", {}).get(key)
+    if job is None:
+        return None
+
+    if job.running:
+        st.progress(job.fraction)
+        st.caption(f"{job.name}: {job.message} ({job.elapsed:.0f}s)")
+        time.sleep(poll_interval)
+        st.experimental_rerun()
+    elif job.error is not None:
+        st.error(f"{job.name} failed: {job.error}")
+    return job
+
+
+def run_scrape(progress, topic_model_settings):
+    """Scrapes with the saved config, then fits a topic model if asked to. Runs as a background job."""
+    # only the topic model fit is left once the scrape is done
+    share = 0.8 if topic_model_settings.get("fit") else 1.0
+    scraper = Scrape(skip_if_file_exists=False, progress=lambda fraction, message: progress(fraction * share, message))
+    scraper.scrape()
+
+    if topic_model_settings.get("fit") and scraper.documents:
+        progress(share, f"Fitting the topic model on {len(scraper.documents)} documents")
+        fit_topics(scraper.documents, topic_model_settings, scraper.document_frame)
+
+    return {"output_files": scraper.output_files, "document_filters": scraper.document_filters}
+
+
+def run_topic_model(progress, output_files, document_filters, topic_model_settings):
+    """Fits a topic model on already scraped files. Runs as a background job."""
+    progress(0.0, "Reading documents")
+    document_frame = extract_documents(output_files, **document_filters)
+    progress(0.1, f"Fitting the topic model on {len(document_frame)} documents")
+    fit_topics(document_frame["text"].tolist(), topic_model_settings, document_frame)
+
+
+def fit_topics(documents, settings, metadata=None):
+    # imported here so the page loads without pulling in BERTopic
+    from topic_model import configured_embedder, topic_model
+
+    return topic_model(
+        documents,
+        configured_embedder(settings),
+        cache_max_bytes=settings.get("cache_max_bytes"),
+        preset=settings.get("preset", "default"),
+        n_components=settings.get("n_components", 5),
+        n_clusters=settings.get("n_clusters", 50),
+        sample_size=settings.get("sample_size"),
+        metadata=metadata)
+
+
+def files_signature(output_files):
+    """Identifies the content of files by path, size and modification time, to key cached results on."""
+    return tuple((f, os.path.getsize(f), os.path.getmtime(f)) for f in output_files if os.path.isfile(f))
+
+
+@st.cache_resource(show_spinner=False)
+def load_topic_classifier(name="batch", version=None, cache_max_bytes=None, embedding_batch_size=64, embedding_processes=None):
+    # imported here so the page loads without pulling in BERTopic
+    from topic_model import TopicClassifier
+
+    # the version is part of the cache key, so a newly saved model is picked up
+    classifier = TopicClassifier(
+        name, version, cache_max_bytes=cache_max_bytes,
+        embedding_batch_size=embedding_batch_size, embedding_processes=embedding_processes)
+    classifier.load()
+    return classifier
+
+
+def classify_documents(progress, signature, document_filters, name, version, settings):
+    """Returns the documents of the scraped files with their topic, and a summary of every topic. Runs as a background job."""
+    progress(0.0, "Reading documents")
+    documents = extract_documents([f for f, _, _ in signature], **document_filters)
+    progress(0.1, "Loading the topic model")
+    classifier = load_topic_classifier(
+        name, version, settings.get("cache_max_bytes"), settings.get("embedding_batch_size") or 64, settings.get("embedding_processes"))
+
+    texts = documents["text"].tolist()
+    topics = []
+    for start in range(0, len(texts), classifier.batch_size):
+        progress(0.1 + 0.9 * start / len(texts), f"Assigning topics to {len(texts)} documents")
+        batch_topics, _ = classifier.transform(texts[start:start + classifier.batch_size])
+        topics.extend(batch_topics)
+    documents = documents.assign(topic=topics)
+
+    summary = documents["topic"].value_counts().rename_axis("topic").reset_index(name="documents")
+    summary["words"] = [
+        ", ".join(word for word, _ in (classifier.model.get_topic(topic) or [])[:5])
+        for topic in summary["topic"]
+    ]
+    return documents, summary
 
-    if len(output_files) == 1:
-        df = load_dataframe_from_csv(output_files[0])
-        st.table(df)
 
-    else:
-        filenames = {os.path.basename(path): path for path in output_files}
+def display_topics(output_files, document_filters, settings=None, name="batch"):
+    version = latest_version(name)
 
-        for filename in filenames.keys():
-            keyword = filename.split("_")[1]
-            df = load_dataframe_from_csv(filenames[filename])
-            st.write(f"{keyword}")
-            st.dataframe(df)
+    # classified again in the background only when the files, filters, model or embedding settings changed
+    settings = {key: (settings or {}).get(key) for key in ["cache_max_bytes", "embedding_batch_size", "embedding_processes"]}
+    args = (files_signature(output_files), document_filters, name, version, settings)
+    job = st.session_state.get("jobs", {}).get("topics")
+    if job is None or (job.args != args and not job.running):
+        start_job("topics", classify_documents, *args)
+    job = display_job("topics")
+    if job.result is None:
+        return None
+    documents, summary = job.result
 
+    st.write(f"Topics from the saved {name} model ({version})")
+    st.dataframe(summary)
 
-def load_dataframe_from_csv(filepath):
-    df = pd.read_csv(filepath)
-    df.drop(columns=["Unnamed: 0"], inplace=True)
-    return df
+    topic = st.selectbox("Show the documents of topic", options=summary["topic"].tolist())
+    topic_documents = documents[documents["topic"] == topic]
+    st.write(f"{len(topic_documents)} documents")
+    st.dataframe(topic_documents.drop(columns=["topic"]).head(1000))
+    return documents
@@ -0,0 +1,218 @@
+import sys
+import json
+import time
+import bisect
+import pstats
+import cProfile
+import threading
+from contextlib import contextmanager
+
+from checkpoint import write_atomic
+
+
+# upper bounds of the histogram buckets, the last one catches everything
+SECONDS_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, float("inf")]
+ROWS_BUCKETS = [0, 1, 10, 50, 100, 250, 500, 1000, float("inf")]
+BYTES_BUCKETS = [1e3, 1e4, 1e5, 5e5, 1e6, 5e6, float("inf")]
+
+PREFIX = "reddit_"
+
+
+def escape(value):
+    """Escapes a Prometheus label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    def __init__(self):
+        """Counters and histograms of the scrape and topic model pipeline, labelled
+        e.g. by keyword, subreddit and kind (posts or comments).
+
+        Labels set with `labels()` apply to everything recorded by the same
+        thread inside the block, so code deep down the call stack (like the
+        HTTP client) doesn't need to know which job it is working for. Every
+        measurement can also be appended to a JSON-lines log as it happens; the
+        totals are exported in the Prometheus text format.
+        """
+        self.counters = {}
+        self.histograms = {}
+        self.jsonl_file = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+
+    def configure(self, jsonl=None):
+        """Starts (or with none, stops) appending every measurement to the JSON-lines file `jsonl`."""
+        with self._lock:
+            if self.jsonl_file is not None:
+                self.jsonl_file.close()
+            self.jsonl_file = open(jsonl, "a", encoding="utf-8") if jsonl else None
+
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.histograms = {}
+
+
+    @contextmanager
+    def labels(self, **labels):
+        """Adds `labels` to everything this thread records inside the block."""
+        previous = self.current_labels()
+        self._local.labels = dict(previous, **{k: v for k, v in labels.items() if v is not None})
+        try:
+            yield
+        finally:
+            self._local.labels = previous
+
+
+    def current_labels(self):
+        return getattr(self._local, "labels", {})
+
+
+    def key(self, name, labels):
+        labels = dict(self.current_labels(), **labels)
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+    def count(self, name, value=1, **labels):
+        """Adds `value` to the counter `name`."""
+        key = self.key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.log("counter", key, value)
+
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS, **labels):
+        """Records one observation of the histogram `name`."""
+        key = self.key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            histogram["counts"][bisect.bisect_left(histogram["buckets"], value)] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+            self.log("histogram", key, value)
+
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes how many seconds the block takes in the histogram `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+
+    def timed(self, name, function, **labels):
+        """Wraps `function` so every call is timed in the histogram `name`."""
+        def wrapper(*args, **kwargs):
+            with self.timer(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+
+
+    def total(self, name, **labels):
+        """Sum of the counter `name` over every label set that includes `labels`."""
+        wanted = {(k, str(v)) for k, v in labels.items()}
+        with self._lock:
+            return sum(value for (n, key), value in self.counters.items() if n == name and wanted <= set(key))
+
+
+    def log(self, kind, key, value):
+        # called with the lock held
+        if self.jsonl_file is None:
+            return
+        name, labels = key
+        self.jsonl_file.write(json.dumps({"time": time.time(), "type": kind, "name": name, "value": value, "labels": dict(labels)}) + "\n")
+        self.jsonl_file.flush()
+
+
+    def prometheus(self):
+        """Returns every counter and histogram in the Prometheus text exposition format."""
+        def format_labels(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"{PREFIX}{name}{format_labels(labels)} {value}")
+
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for (n, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{PREFIX}{name}_bucket{format_labels(labels, [('le', le)])} {cumulative}")
+                    lines.append(f"{PREFIX}{name}_sum{format_labels(labels)} {histogram['sum']}")
+                    lines.append(f"{PREFIX}{name}_count{format_labels(labels)} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+    def write_prometheus(self, path):
+        """Writes the Prometheus text to `path`, e.g. for the node exporter's textfile collector."""
+        text = self.prometheus()
+
+        def dump(tmp_path):
+            with open(tmp_path, "w") as f:
+                f.write(text)
+
+        # the collector must never read a half-written file
+        write_atomic(path, dump)
+
+
+# shared by every module of the pipeline
+METRICS = Metrics()
+
+
+@contextmanager
+def profile(path=None):
+    """Profiles the block with cProfile and saves the stats to `path` (read them with pstats or snakeviz).
+    Threads started inside the block, like the scrape workers, are profiled too.
+    Does nothing if `path` is none, so it can wrap a stage unconditionally.
+
+    Sampling profilers like py-spy need no hook: worker threads are named
+    after their stage, so `py-spy dump --pid` stays readable.
+    """
+    if not path:
+        yield
+        return
+
+    profilers = [cProfile.Profile()]
+    lock = threading.Lock()
+
+    def profile_thread(frame, event, arg):
+        # the first event of a new thread swaps this hook for a profiler of its own
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # only one profiler can be active at a time from python 3.12
+            sys.setprofile(None)
+            return
+        with lock:
+            profilers.append(profiler)
+
+    threading.setprofile(profile_thread)
+    profilers[0].enable()
+    try:
+        yield
+    finally:
+        profilers[0].disable()
+        threading.setprofile(None)
+        with lock:
+            pstats.Stats(*profilers).dump_stats(path)
+        print(f"Saved profile to {path}")
@@ -0,0 +1,143 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+class RateLimiter:
+    def __init__(self, requests_per_second, burst=1, max_retries=5, backoff_base=1.0, backoff_max=60.0):
+        """Token bucket shared by every thread that talks to the API.
+
+        The bucket refills at `requests_per_second` and holds at most `burst` tokens.
+        When the server pushes back (429/5xx) the refill rate is halved and then
+        creeps back up to the configured rate with every successful request.
+
+        Args:
+            requests_per_second (float): maximum sustained request rate across all callers
+            burst (int, optional): how many requests can go out back to back. Defaults to 1.
+            max_retries (int, optional): how many times a failed request is retried. Defaults to 5.
+            backoff_base (float, optional): first retry delay in seconds, doubled on every attempt. Defaults to 1.0.
+            backoff_max (float, optional): cap on a single retry delay in seconds. Defaults to 60.0.
+        """
+        self.max_rate = float(requests_per_second)
+        self.min_rate = self.max_rate / 16
+        self.rate = self.max_rate
+        self.burst = max(1, burst)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+
+    def wait(self):
+        """Blocks until the caller is allowed to issue one request."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now < self._paused_until:
+                    delay = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    delay = (1 - self._tokens) / self.rate
+
+            time.sleep(delay)
+
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+    def pause(self, seconds):
+        """Stops every caller from issuing requests for the next `seconds`."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+    def on_success(self, headers=None):
+        """Records a successful response, slowly restoring the request rate."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+        if headers:
+            reset = RateLimiter.exhausted_budget_reset(headers)
+            if reset:
+                self.pause(reset)
+
+
+    def on_throttle(self, attempt, headers=None):
+        """Records a rate limited or failed response and computes how long to back off.
+
+        Args:
+            attempt (int): how many times this request has already been tried
+            headers (dict, optional): response headers, checked for Retry-After and rate limit hints
+
+        Returns:
+            float: seconds to wait before retrying
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.min_rate, self.rate / 2)
+
+        delay = RateLimiter.retry_after(headers) if headers else None
+        if delay is None:
+            # jittered exponential backoff so parallel jobs don't retry in lockstep
+            delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+            delay *= random.uniform(0.5, 1.5)
+
+        self.pause(delay)
+        return delay
+
+
+    @staticmethod
+    def retry_after(headers):
+        """Parses the Retry-After header, either in seconds or as an HTTP date.
+
+        Returns:
+            float or None: seconds to wait, None if the header is missing or unreadable
+        """
+        value = headers.get("Retry-After")
+        if value is None:
+            return RateLimiter.exhausted_budget_reset(headers)
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, when.timestamp() - time.time())
+
+
+    @staticmethod
+    def exhausted_budget_reset(headers):
+        """Reads X-RateLimit-* headers and returns the seconds until the budget resets
+        when no requests are left, None otherwise."""
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if remaining is None or reset is None:
+            return None
+
+        try:
+            if float(remaining) > 0:
+                return None
+            reset = float(reset)
+        except ValueError:
+            return None
+
+        # some servers send an absolute unix time, others the seconds left
+        if reset > time.time():
+            reset -= time.time()
+        return max(0.0, reset)
@@ -1,18 +1,28 @@
 import datetime, calendar
 import os.path
+from concurrent.futures import ThreadPoolExecutor
 
 from dateutil.relativedelta import relativedelta
 from os import stat
-import requests
 import pandas as pd
-import json
-import time
+
+from client import API_URL, PushshiftClient, PushshiftError
+from checkpoint import Checkpoint
+from schema import apply_schema
+from metrics import METRICS
 
 TODAY = datetime.datetime.utcnow()
 
+# Reddit has a rate limit: one request every 2 seconds unless the caller brings a client of its own
+DEFAULT_CLIENT = PushshiftClient()
+
+# the fields clean_df keeps, the only ones requested from the API
+POST_FIELDS = ["id", "created_utc", "subreddit", "score", "title", "selftext", "url", "num_comments"]
+COMMENT_FIELDS = ["id", "created_utc", "subreddit", "score", "body"]
+
 
 class Reddit:
-    def __init__(self, restart_from_file, start_date, end_date, keyword, include_comments, save_every=None, out_file=None, subreddit=None):
+    def __init__(self, restart_from_file, start_date, end_date, keyword, include_comments, save_every=None, out_file=None, subreddit=None, include_posts=True, client=None, partition=None, max_window_workers=4, on_page=None, filters=None):
         """Class initialization
 
         Args:
@@ -21,8 +31,16 @@ class Reddit:
             keyword (string): we'll pull posts containing this keyword
             include_comments (boolean): whether to include comments when pulling posts
             save_every (int, optional): save interstitial results every n calls
-            out_file (str, optional): file to save interstitial results to
+            out_file (str, optional): path prefix for the interstitial results (checkpoint directories)
             subreddit (str, optional): which subreddit to filter on. if none, searches all subreddits.
+            include_posts (boolean, optional): whether to pull main posts. Defaults to True.
+            client (PushshiftClient, optional): HTTP transport and request budget shared with other Reddit instances
+            partition (str or int, optional): split the date range into "day" or "week" windows, or into n equal windows,
+                and page through them in parallel. if none, the whole range is paged through in one go.
+            max_window_workers (int, optional): how many windows to page through at the same time. Defaults to 4.
+            on_page (callable, optional): called with every page as soon as it is pulled. when given,
+                results are streamed to it instead of being kept in memory and self.posts stays empty.
+            filters (dict, optional): min_score, min_num_comments and exclude_deleted_authors, applied by the API (see create_url)
         """
         self.start_date = start_date
         self.end_date = end_date
@@ -31,39 +49,31 @@ class Reddit:
 
         self.subreddit = subreddit
         self.restart_from_file = restart_from_file
+        self.client = client or DEFAULT_CLIENT
+        self.partition = partition
+        self.max_window_workers = max_window_workers
+        self.on_page = on_page
+        self.filters = filters
 
-        self.out_file = f"{out_file}_main.pkl"
-        df_main = self.get_posts_in_date_range(comment=False)
+        frames = []
+        if include_posts:
+            self.out_file = f"{out_file}_main"
+            frames.append(self.get_posts_in_date_range(comment=False))
 
         if include_comments:
-            self.out_file = f"{out_file}_comments.pkl"
-            df_comments = self.get_posts_in_date_range(comment=True)
-            self.posts = df_main.append(df_comments)
-        else:
-            self.posts = df_main
-
-
-    def get_initial_df(self, comment):
-        """This function loads the initial dataframe.
-
-        Args:
-            comment (boolean): whether we're pulling a main post or a comment
+            self.out_file = f"{out_file}_comments"
+            frames.append(self.get_posts_in_date_range(comment=True))
 
-        Returns:
-            dataframe
-        """
-        # fist data pull for a given keyword
-        if self.restart_from_file and os.path.exists(self.out_file):
-            print(f"Reading from file {self.out_file}")
-            return pd.read_pickle(self.out_file)                
-        else:
-            return self.get_pull_df(comment, df_previous_pull=None)
+        frames = [df for df in frames if not df.empty]
+        self.posts = apply_schema(pd.concat(frames, ignore_index=True)) if frames else pd.DataFrame()
 
 
     def get_posts_in_date_range(self, comment):
         """This function pulls posts in a user defined date range
         and containing a specific keyword.
         Because of Reddit rate limit, we can pull data in chunks.
+        When partitioning is on, every window is paged through in parallel
+        and the results are merged and de-duplicated by id.
 
         Args:
             comment (boolean): pulling main post or comments
@@ -71,48 +81,124 @@ class Reddit:
         Returns:
             dataframe containing posts
         """
+        windows = self.get_windows()
 
-        # fist data pull for a given keyword
-        df = self.get_initial_df(comment)
+        if len(windows) == 1:
+            start_date, end_date = windows[0]
+            return self.get_posts_in_window(comment, start_date, end_date, self.out_file)
 
-        if df.empty:
-            print(f"\n\n***\nno submissions for keyword={self.keyword}\n***\n\n")
+        window_files = [f"{self.out_file}_{n}" for n in range(len(windows))]
+
+        with ThreadPoolExecutor(max_workers=min(len(windows), self.max_window_workers), thread_name_prefix="scrape-window") as executor:
+            frames = list(executor.map(
+                lambda args: self.get_posts_in_window(comment, *args),
+                [(start_date, end_date, f) for (start_date, end_date), f in zip(windows, window_files)]
+            ))
+
+        frames = [df for df in frames if not df.empty]
+        if not frames:
             return pd.DataFrame()
-        # adding more data a little bit at the time.
-        else:
-            print(
-                f"\n\n* starting data time interval from {df['created_utc'].min()} to {df['created_utc'].max()}"
-            )
 
+        df = apply_schema(pd.concat(frames, ignore_index=True))
+        return df.drop_duplicates(subset="id").sort_values("created_utc_unix", ignore_index=True)
+
+
+    def get_posts_in_window(self, comment, start_date, end_date, out_file):
+        """This function pages through one time window, one request at a time.
+        Pages are appended to a checkpoint every `save_every` calls; with
+        restart_from_file the pull resumes from the checkpoint's cursor.
+
+        Args:
+            comment (boolean): pulling main post or comments
+            start_date (int): start of the window in unix time
+            end_date (int): end of the window in unix time
+            out_file (str): checkpoint directory for the window
+
+        Returns:
+            dataframe containing posts
+        """
+        kind = "comments" if comment else "posts"
+        with METRICS.labels(keyword=self.keyword, subreddit=self.subreddit, kind=kind):
+            checkpoint = Checkpoint(out_file)
+
+            # streamed pages are only held until the next save, so make sure there is one
+            save_every = self.save_every or (10 if self.on_page else None)
+            pages = 0
+
+            if self.restart_from_file and checkpoint.complete:
+                print(f"Reading from file {out_file}")
+                return self.stream(apply_schema(checkpoint.load()))
+
+            if self.restart_from_file and checkpoint.cursor is not None:
+                print(f"Resuming {out_file} from {datetime.datetime.utcfromtimestamp(checkpoint.cursor)}")
+                cursor = checkpoint.cursor
+                if self.on_page:
+                    # pages saved by the previous run haven't been handed over in this one
+                    self.on_page(apply_schema(checkpoint.load()))
+            else:
+                checkpoint.clear()
+
+                # fist data pull for a given keyword
+                df = self.get_pull_df(comment, None, start_date, end_date)
+
+                if df.empty:
+                    print(f"\n\n***\nno submissions for keyword={self.keyword}\n***\n\n")
+                    return pd.DataFrame()
+
+                checkpoint.add(df)
+                pages += 1
+                cursor = df["created_utc_unix"].max()
+                if self.on_page:
+                    with METRICS.timer("write_seconds"):
+                        self.on_page(df)
+
+            # adding more data a little bit at the time.
             for i in range(1000000):
-                df_step = self.get_pull_df(comment, df_previous_pull=df)
-                
+                try:
+                    df_step = self.get_pull_df(comment, cursor, start_date, end_date)
+                except PushshiftError:
+                    # keep what we have so the scrape can be resumed with restart_from_file
+                    with METRICS.timer("checkpoint_seconds", operation="flush"):
+                        checkpoint.flush()
+                    raise
+
                 if df_step.empty:
                     break
 
-                df = df.append(df_step, ignore_index=True)
+                checkpoint.add(df_step)
+                pages += 1
+                cursor = df_step["created_utc_unix"].max()
+                if self.on_page:
+                    with METRICS.timer("write_seconds"):
+                        self.on_page(df_step)
 
-                print(
-                    f"\n* current data time interval from {df_step['created_utc'].min()} to {df_step['created_utc'].max()}, count = {len(df_step)}"
-                )
-                if self.save_every and self.out_file:
-                    if i > 0 and i % self.save_every == 0:
-                        print('Saving interstitial...')
-                        if os.path.exists(self.out_file):
-                            current_df = pd.read_pickle(self.out_file)
-                            combined = current_df.append(df, ignore_index=True)
-                            combined.drop_duplicates().to_pickle(self.out_file)
-                        else:
-                            df.to_pickle(self.out_file)                            
+                if save_every and i > 0 and i % save_every == 0:
+                    with METRICS.timer("checkpoint_seconds", operation="flush"):
+                        checkpoint.flush()
 
-                # need a sleeper cause Reddit has a rate limit
-                time.sleep(2)
+            with METRICS.timer("checkpoint_seconds", operation="finish"):
+                checkpoint.finish()
 
-            df.to_pickle(self.out_file)
-            return df
+            # one line per window instead of one per page
+            print(
+                f"{self.keyword} {kind}{f' in r/{self.subreddit}' if self.subreddit else ''}: "
+                f"{pages} pages up to {datetime.datetime.utcfromtimestamp(cursor)}"
+            )
+            if self.on_page:
+                return pd.DataFrame()
+            with METRICS.timer("checkpoint_seconds", operation="load"):
+                return apply_schema(checkpoint.load())
 
 
-    def get_pull_df(self, comment, df_previous_pull):
+    def stream(self, df):
+        """Hands `df` over to on_page if results are streamed, otherwise returns it."""
+        if self.on_page:
+            self.on_page(df)
+            return pd.DataFrame()
+        return df
+
+
+    def get_pull_df(self, comment, cursor, start_date, end_date):
         """This function determines the time interval for
         a query based on previously pulled data.
         It then pulls data in that time interval and containing a given
@@ -120,15 +206,17 @@ class Reddit:
 
         Args:
             comment (boolean): whether we are pulling main posts or comments
-            df_previous_pull (dataframe): date pulled so far
+            cursor (int): created_utc_unix of the last record pulled so far, None for the first pull
+            start_date (int): start of the window in unix time
+            end_date (int): end of the window in unix time
 
         Returns:
             dataframe with data in new time interval
         """
 
-        #during the first pull, these are the dates in the confi.json. 
+        #during the first pull, these are the window dates. 
         #for any subsequent pull, the start date is taken from the data pulled so dar
-        start_date, end_date = self.get_dates(df_previous_pull)
+        start_date, end_date = self.get_dates(cursor, start_date, end_date)
         start_date_human_readable = datetime.datetime.utcfromtimestamp(start_date)        
         
         #FIXME I think this condition is never encountered...but anyway...
@@ -139,33 +227,48 @@ class Reddit:
             print("\n\n***\nData pulled up to today...\n***\n\n")
             return pd.DataFrame()
         else:
-            return Reddit.pull_posts(start_date, end_date, self.keyword, comment, self.subreddit)
+            return Reddit.pull_posts(start_date, end_date, self.keyword, comment, self.subreddit, self.client, self.filters)
 
 
-    def get_dates(self, df_previous_pull):
+    def get_dates(self, cursor, start_date, end_date):
         """This function computes the time interval for a data pull.
-        - For the first data pull, the start and end dates are those provided in
-        the configuration file.
+        - For the first data pull, the start and end dates are those of the window.
         - For any subsequent pull, the start date is recalculated based on the
         last post from the previous pull.
         This approach is needed to get around Reddit rate limit.
 
         Args:
-            df_previous_pull (dataframe): dataframe containing the data pulled so far
+            cursor (int): created_utc_unix of the last record pulled so far, None for the first pull
+            start_date (int): start of the window in unix time
+            end_date (int): end of the window in unix time
 
         Returns:
             tuple containing start and end dates in unix time
         """
-        if df_previous_pull is None:
-            my_date = datetime.datetime(
-                self.start_date.year, 
-                self.start_date.month, 
-                self.start_date.day).date()
-            start_date_unix = calendar.timegm(my_date.timetuple())
+        if cursor is None:
+            start_date_unix = start_date
 
         else:
             # Using as start datetime the last of the previous pull.
-            start_date_unix = df_previous_pull[f"created_utc_unix"].max()
+            start_date_unix = cursor
+
+        end_date_unix = end_date
+
+        return start_date_unix, end_date_unix
+
+
+    def get_windows(self):
+        """This function splits the date range from the configuration file into
+        the time windows that are paged through independently.
+
+        Returns:
+            list of (start, end) tuples in unix time
+        """
+        my_date = datetime.datetime(
+            self.start_date.year, 
+            self.start_date.month, 
+            self.start_date.day).date()
+        start_date_unix = calendar.timegm(my_date.timetuple())
 
         my_date = datetime.datetime(
                 self.end_date.year, 
@@ -173,33 +276,44 @@ class Reddit:
                 self.end_date.day).date()
         end_date_unix = calendar.timegm(my_date.timetuple())
 
-        print(f"Start date = {datetime.datetime.utcfromtimestamp(start_date_unix)}")
-        print(f"End date = {datetime.datetime.utcfromtimestamp(end_date_unix)}")
+        # `after` is exclusive, so every window starts one second early to keep
+        # posts created exactly on its first second
+        if not self.partition:
+            return [(start_date_unix - 1, end_date_unix)]
 
-        return start_date_unix, end_date_unix
+        if self.partition == "day":
+            step = 24 * 60 * 60
+        elif self.partition == "week":
+            step = 7 * 24 * 60 * 60
+        else:
+            step = max(1, -(-(end_date_unix - start_date_unix) // int(self.partition)))
+
+        boundaries = list(range(start_date_unix, end_date_unix, step)) + [end_date_unix]
+        windows = [(after - 1, before) for after, before in zip(boundaries[:-1], boundaries[1:])]
+
+        return windows or [(start_date_unix - 1, end_date_unix)]
 
 
     @staticmethod
-    def get_pushshift_data(url):
+    def get_pushshift_data(url, client=None):
         """This function queries Reddit pushshift API.
+        An empty dataframe means there is no more data; failed requests raise.
 
         Args:
             url (string): the url to query
+            client (PushshiftClient, optional): transport to send the request with. Defaults to the module-wide one.
+
+        Raises:
+            PushshiftError: if the request still fails after all retries
 
         Returns:
             json response
         """
-        print(url)
-        r = requests.get(url)
-        try:
-            json_respose = json.loads(r.text)            
-            return pd.DataFrame(json_respose["data"])
-        except:
-            return pd.DataFrame()
+        return (client or DEFAULT_CLIENT).get_data(url)
 
 
     @staticmethod
-    def pull_posts(start_date, end_date, keyword, comment, subreddit=None):
+    def pull_posts(start_date, end_date, keyword, comment, subreddit=None, client=None, filters=None):
         """This function queries the Reddit pushshift API
         for posts containing a give keyword and in a given time range.
 
@@ -209,34 +323,34 @@ class Reddit:
             keyword (string): keyword that a post needs to contain
             comment (boolean): whether to pull main posts or comments
             subreddit (str, optional): which subreddit to filter on. if none, searches all subreddits.
+            client (PushshiftClient, optional): transport to send the request with
+            filters (dict, optional): filters applied by the API, see create_url
 
         Returns:
             dataframe containing the posts
         """
-        url = Reddit.create_url(start_date, end_date, keyword, comment, subreddit)
-        df = Reddit.get_pushshift_data(url)
+        client = client or DEFAULT_CLIENT
+        url = Reddit.create_url(start_date, end_date, keyword, comment, subreddit, client.api_url, client.page_sizes[comment], filters)
+        df = Reddit.get_pushshift_data(url, client)
         
         if df.empty:
             return pd.DataFrame()
 
-        df = Reddit.clean_df(df, keyword)
-
-        if comment: df['is_comment'] = True
-        else: df['is_comment'] = False
-
-        return df
+        with METRICS.timer("clean_seconds"):
+            return Reddit.clean_df(df, keyword, comment)
 
 
     @staticmethod
-    def clean_df(df, keyword):
+    def clean_df(df, keyword, comment=False):
         """This function contains the cleaning rules for the posts.
 
         Args:
             df (dataframe): original dataframe
             keyword (string): keyword the search is based on
+            comment (boolean, optional): whether the records are comments. Defaults to False.
 
         Returns:
-            dataframe with less and re-organized columns
+            dataframe with less and re-organized columns, typed according to schema.SCHEMA
         """
 
         cols_rename_dict = {"selftext": "body", "created_utc": "created_utc_unix"}
@@ -265,21 +379,22 @@ class Reddit:
             return new_df
 
         new_df = new_df[cols_to_keep].copy()
-        # FIXME ADD A TEST HERE TO CHECK TIME WAS CONVERTED CORRECTLY
-        new_df["created_utc"] = new_df["created_utc_unix"].apply(
-            lambda x: datetime.datetime.utcfromtimestamp(x).strftime(
-                "%Y-%m-%d %H:%M:%S"
-            )
-        )
+        # created_utc is derived from created_utc_unix by apply_schema
+        new_df["created_utc"] = new_df["created_utc_unix"]
 
         new_df["keyword"] = keyword
+        new_df["is_comment"] = comment
         new_df.reset_index(inplace=True, drop=True)
-        return new_df
+        return apply_schema(new_df)
 
 
     @staticmethod
-    def create_url(after, before, keyword, comment=False, subreddit=None):
+    def create_url(after, before, keyword, comment=False, subreddit=None, api_url=API_URL, size=None, filters=None):
         """This function creates a Reddit url.
+        Only the fields clean_df keeps are requested, and filters are left to
+        the API so dropped records are never sent. An API that ignores a
+        filter returns the records unfiltered; documents.extract_documents
+        can still drop removed ones.
 
         Args:
             after (int): only posts after this time in unix time will be pulled
@@ -287,18 +402,33 @@ class Reddit:
             keyword (string): keyword the search is based on
             comment (bool, optional): whether we're pulling main posts or their comments. Defaults to False.
             subreddit (str, optional): which subreddit to filter on. if none, searches all subreddits.
+            api_url (str, optional): base url of the pushshift API. Defaults to client.API_URL.
+            size (int, optional): records per page. Defaults to 1000 for posts and 500 for comments.
+            filters (dict, optional): min_score (int), min_num_comments (int, posts only)
+                and exclude_deleted_authors (bool). Defaults to no filters.
 
         Returns:
             string: a url for the posts to query
         """
         if comment:
             # pulling comments
-            url = f"https://api.pushshift.io/reddit/comment/search/?q={keyword}&size=500&after={after}&before={before}"
+            url = f"{api_url}/reddit/comment/search/?q={keyword}&size={size or 500}&after={after}&before={before}"
+            url += f"&fields={','.join(COMMENT_FIELDS)}"
         else:
             # pulling main post
-            url = f"https://api.pushshift.io/reddit/search/submission/?q={keyword}&size=1000&after={after}&before={before}"
+            url = f"{api_url}/reddit/search/submission/?q={keyword}&size={size or 1000}&after={after}&before={before}"
+            url += f"&fields={','.join(POST_FIELDS)}"
 
         if subreddit:
             url += f'&subreddit={subreddit}'
 
+        filters = filters or {}
+        # pushshift compares with > only, scores are whole numbers
+        if filters.get("min_score") is not None:
+            url += f"&score=>{int(filters['min_score']) - 1}"
+        if filters.get("min_num_comments") is not None and not comment:
+            url += f"&num_comments=>{int(filters['min_num_comments']) - 1}"
+        if filters.get("exclude_deleted_authors"):
+            url += "&author=![deleted]"
+
         return url
@@ -0,0 +1,50 @@
+import pandas as pd
+
+
+# dtypes of the records produced by Reddit.pull_posts, for posts and comments alike
+SCHEMA = {
+    "title": "object",
+    "score": "int32",
+    "id": "object",
+    "subreddit": "category",
+    "url": "object",
+    "num_comments": "int32",
+    "body": "object",
+    "created_utc_unix": "int64",
+    "created_utc": "datetime64[ns]",
+    "keyword": "category",
+    "is_comment": "bool",
+}
+
+
+def apply_schema(df):
+    """Casts a records dataframe to SCHEMA.
+
+    Needs to be called again after concatenating frames, since pandas falls back
+    to object columns when categoricals with different categories are combined.
+
+    Args:
+        df (dataframe): records with (a subset of) the SCHEMA columns
+
+    Returns:
+        dataframe with compact, consistent dtypes
+    """
+    if df.empty:
+        return df
+
+    df = df.copy()
+    for column, dtype in SCHEMA.items():
+        if column not in df.columns:
+            continue
+
+        if column == "created_utc":
+            # derived from the unix time in one vectorized call instead of formatting row by row
+            df[column] = pd.to_datetime(df["created_utc_unix"], unit="s")
+        elif dtype in ("int32", "int64"):
+            df[column] = pd.to_numeric(df[column], errors="coerce").fillna(0).astype(dtype)
+        elif dtype == "bool":
+            df[column] = df[column].astype(bool)
+        elif dtype == "category":
+            df[column] = df[column].astype("category")
+
+    return df
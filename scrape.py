@@ -1,40 +1,92 @@
 import os
 import json
 from pathlib import Path
+import calendar
+import threading
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 
 from reddit import Reddit
+from client import PushshiftClient
+from ratelimit import RateLimiter
+from checkpoint import remove_checkpoints
+from corpus import Corpus
+from writers import STREAMING_FORMATS, open_writer
+from documents import extract_documents
+from schema import apply_schema
+from metrics import METRICS, profile
+from keywords import MAX_QUERY_LENGTH, KeywordMatcher, batch_name, keyword_batches, keyword_query
 
 
 CURRENT_DIR = os.getcwd()
 OUTPUT_FOLDER = f"{CURRENT_DIR}/data"
-OUTPUT_FOLDER_IN_PROGRESS = f"{OUTPUT_FOLDER}/in_progress"
 
 
 class Scrape:
-    def __init__(self, skip_if_file_exists=True):
+    def __init__(self, skip_if_file_exists=True, progress=None, config_path="config.json", output_dir=OUTPUT_FOLDER):
         # self.parse_config_file()
         # self.create_output_folder()
         self.skip_if_file_exists = skip_if_file_exists
+        self.config_path = config_path
+        # checkpoints go in a folder of the output folder, so scrapes with different output folders never share one
+        self.output_folder = output_dir
+        self.output_folder_in_progress = os.path.join(output_dir, "in_progress")
         self.documents = []
+        self.document_frame = None
+        self.topic_model_settings = {}
+        self.writers = {}
+        # matcher of every OR query of batched keywords
+        self.matchers = {}
+
+        # progress(fraction, message) is called whenever a job finishes, e.g. by jobs.Job
+        self.progress = progress
+        self.jobs_total = 0
+        self.jobs_done = 0
+        self._progress_lock = threading.Lock()
 
 
     def scrape(self):
         self.parse_config_file()
         self.create_output_folder()
+        # every scrape exports its own numbers
+        METRICS.reset()
+        METRICS.configure(self.metrics.get("jsonl"))
 
+        # every (keyword, subreddit, posts/comments) job goes into one pool so they all
+        # run side by side, while the rate limiter keeps the whole pool under one request budget
         self.output_files = []
-        for n, keyword in enumerate(self.keywords):
-            filename = self.scrape_keyword(n, keyword)
-            self.output_files.append(filename)
+        with profile(self.metrics.get("profile")):
+            queries = self.get_queries()
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scrape-job") as executor:
+                submitted = [
+                    self.submit_keyword(executor, n, keywords[0]) if len(keywords) == 1
+                    else self.submit_batch(executor, n, query, keywords)
+                    for n, (query, keywords) in enumerate(queries)
+                ]
+                for (query, keywords), jobs in zip(queries, submitted):
+                    if len(keywords) == 1:
+                        self.output_files.append(self.collect_keyword(keywords[0], jobs))
+                    else:
+                        self.output_files.extend(self.collect_batch(query, jobs))
+
+            with METRICS.timer("extract_documents_seconds"):
+                self.clean_for_topic_modeling()
 
-        self.clean_for_topic_modeling()
+        if self.metrics.get("prometheus"):
+            METRICS.write_prometheus(self.metrics["prometheus"])
+        print(
+            f"Scraped {METRICS.total('rows_total')} records in {METRICS.total('pages_total')} pages "
+            f"({METRICS.total('retries_total')} retries)"
+        )
+        unattributed = METRICS.total("unattributed_records_total")
+        if unattributed:
+            print(f"Dropped {unattributed} records of combined keyword queries that mention none of the keywords")
         
 
     def parse_config_file(self):
-        with open(Path("config.json")) as config_file:
+        with open(Path(self.config_path)) as config_file:
             config = json.load(config_file)
 
         self.keywords = list(set(config["keywords"]))
@@ -50,6 +102,13 @@ class Scrape:
         self.include_comments = include_comments == "true"
         self.save_every = config.get('save_every')
         self.file_format = config.get("file_format")
+        self.compression = config.get("compression")
+        self.document_filters = config.get("document_filters", {})
+        self.topic_model_settings = config.get("topic_model", {})
+        self.metrics = config.get("metrics") or {}
+        self.query_filters = config.get("query_filters") or {}
+        self.batch_keywords = config.get("batch_keywords", False)
+        self.max_query_length = config.get("max_query_length") or MAX_QUERY_LENGTH
 
         subreddits = config.get('subreddits', [])
         
@@ -58,94 +117,302 @@ class Scrape:
         else:
             self.subreddits = subreddits
 
-        print(f"""
-            keywords = {self.keywords}
-            include_comments = {self.include_comments}
-            """)
+        self.max_workers = config.get("max_workers", 4)
+        self.partition = config.get("partition")
+
+        corpus = config.get("corpus")
+        self.corpus = Corpus(corpus) if corpus else None
+        rate_limiter = RateLimiter(
+            config.get("requests_per_second", 0.5),
+            burst=config.get("burst", 1),
+            max_retries=config.get("max_retries", 5))
+        self.client = PushshiftClient(
+            rate_limiter,
+            timeout=config.get("timeout", 60),
+            pool_size=self.max_workers,
+            api_url=config.get("api_url"),
+            page_size=config.get("page_size"),
+            comment_page_size=config.get("comment_page_size"))
 
 
     def create_output_folder(self):
         # creating folder if it doesn't exist
-        for this_folder in [OUTPUT_FOLDER, OUTPUT_FOLDER_IN_PROGRESS]:
+        for this_folder in [self.output_folder, self.output_folder_in_progress]:
             if not os.path.exists(this_folder):
                 os.makedirs(this_folder)
 
 
-    def scrape_keyword(self, n, keyword):
-        print(f"\nkeyword = {keyword} ({n} out of {len(self.keywords)})")
-
+    def get_filenames(self, keyword):
         # create filename for intermediate states file:
         filename = (
-            f"{OUTPUT_FOLDER_IN_PROGRESS}/reddit_{keyword}_{self.start_date_str}_{self.end_date_str}"
+            f"{self.output_folder_in_progress}/reddit_{keyword}_{self.start_date_str}_{self.end_date_str}"
         )
-        
+
         #create filename for final file
         filename_complete = (
-            f"{OUTPUT_FOLDER}/reddit_{keyword}_{self.start_date_str}_{self.end_date_str}_complete.{self.file_format}"
+            f"{self.output_folder}/reddit_{keyword}_{self.start_date_str}_{self.end_date_str}_complete.{self.get_extension()}"
         )
+        return filename, filename_complete
+
+
+    def get_extension(self):
+        if self.file_format == "jsonl" and self.compression == "gzip":
+            return "jsonl.gz"
+        return self.file_format
+
+
+    def get_queries(self):
+        """Returns the queries to run as (query, keywords) pairs.
+
+        Without batch_keywords every keyword is a query of its own. With it,
+        keywords are combined into OR queries of at most max_query_length
+        characters, so records mentioning several keywords are only fetched
+        once; they are split by keyword again on arrival.
+        """
+        if not self.batch_keywords:
+            return [(keyword, [keyword]) for keyword in self.keywords]
+
+        # keywords scraped by an earlier run stay out of the batches, they're skipped anyway
+        done = [
+            keyword for keyword in self.keywords
+            if self.skip_if_file_exists and os.path.isfile(self.get_filenames(keyword)[1])
+        ]
+        batches = keyword_batches([keyword for keyword in self.keywords if keyword not in done], self.max_query_length)
+        return [(keyword, [keyword]) for keyword in done] + [(keyword_query(batch), batch) for batch in batches]
+
+
+    def scrape_keyword(self, n, keyword):
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="scrape-job") as executor:
+            jobs = self.submit_keyword(executor, n, keyword)
+            return self.collect_keyword(keyword, jobs)
+
+
+    def submit_keyword(self, executor, n, keyword):
+        print(f"\nkeyword = {keyword} ({n} out of {len(self.keywords)})")
+
+        filename, filename_complete = self.get_filenames(keyword)
 
         # skipping the rest of the loop if the file exists (this is to avoid re-downloading)
         if self.skip_if_file_exists and os.path.isfile(filename_complete):
             print(f"\n\n***\n{keyword} file present\n***\n\n")
+            return None
+
+        if self.file_format in STREAMING_FORMATS:
+            # pages go straight to disk as they arrive, the file is moved to its final name once complete
+            self.writers[keyword] = open_writer(
+                f"{filename}.{self.get_extension()}",
+                self.file_format,
+                self.compression)
+
+        return self.submit_jobs(executor, keyword, filename)
+
+
+    def submit_batch(self, executor, n, query, keywords):
+        print(f"\nkeywords = {', '.join(keywords)} (one query for {len(keywords)} keywords)")
+
+        self.matchers[query] = KeywordMatcher(keywords)
+        filename = (
+            f"{self.output_folder_in_progress}/reddit_batch_{batch_name(query)}_{self.start_date_str}_{self.end_date_str}"
+        )
+
+        if self.file_format in STREAMING_FORMATS:
+            for keyword in keywords:
+                self.writers[keyword] = open_writer(
+                    f"{self.get_filenames(keyword)[0]}.{self.get_extension()}",
+                    self.file_format,
+                    self.compression)
+
+        return self.submit_jobs(executor, query, filename)
+
+
+    def submit_jobs(self, executor, keyword, filename):
+        jobs = []
+        for subreddit in self.subreddits or [None]:
+            # each subreddit gets its own intermediate files so parallel jobs don't overwrite each other
+            job_filename = f"{filename}_{subreddit}" if subreddit else filename
+
+            kinds = [False, True] if self.include_comments else [False]
+            for comment in kinds:
+                with self._progress_lock:
+                    self.jobs_total += 1
+                future = executor.submit(self.fetch, keyword, subreddit, comment, job_filename)
+                description = f"{keyword}{f' in r/{subreddit}' if subreddit else ''} {'comments' if comment else 'posts'}"
+                future.add_done_callback(lambda _, description=description: self.job_done(description))
+                jobs.append((job_filename, future))
+
+        return jobs
+
+
+    def job_done(self, description):
+        with self._progress_lock:
+            self.jobs_done += 1
+            if self.progress:
+                self.progress(self.jobs_done / self.jobs_total, f"Scraped {description} ({self.jobs_done} of {self.jobs_total})")
 
+
+    def fetch(self, keyword, subreddit, comment, job_filename):
+        on_page = self.page_writer(keyword)
+        kind = "comments" if comment else "posts"
+
+        with METRICS.labels(keyword=keyword, subreddit=subreddit, kind=kind), METRICS.timer("job_seconds"):
+            if self.corpus:
+                posts = self.fetch_missing(keyword, subreddit, comment, job_filename)
+                if on_page:
+                    on_page(posts)
+                    return pd.DataFrame()
+                return posts
+
+            return self.fetch_range(
+                keyword, 
+                subreddit, 
+                comment, 
+                job_filename, 
+                self.start_date, 
+                self.end_date, 
+                on_page=on_page)
+
+
+    def page_writer(self, query):
+        """Returns the function streaming the pages of `query` to disk, None if results are kept in memory."""
+        matcher = self.matchers.get(query)
+        if matcher is None:
+            writer = self.writers.get(query)
+            return writer.write if writer else None
+
+        if matcher.keywords[0] not in self.writers:
+            return None
+
+        def write(df):
+            for keyword, posts in matcher.attribute(df).groupby("keyword", observed=True):
+                self.writers[keyword].write(posts)
+        return write
+
+
+    def fetch_range(self, keyword, subreddit, comment, job_filename, start_date, end_date, on_page=None):
+        my_reddit = Reddit(
+            self.restart_from_file, 
+            start_date, 
+            end_date, 
+            keyword, 
+            include_comments=comment, 
+            save_every=self.save_every, 
+            out_file=job_filename, 
+            subreddit=subreddit,
+            include_posts=not comment,
+            client=self.client,
+            partition=self.partition,
+            max_window_workers=self.max_workers,
+            on_page=on_page,
+            filters=self.query_filters)
+        return my_reddit.posts
+
+
+    def fetch_missing(self, keyword, subreddit, comment, job_filename):
+        # only the days that aren't in the corpus yet are requested, the rest is read from disk
+        start = calendar.timegm(self.start_date.date().timetuple())
+        end = calendar.timegm(self.end_date.date().timetuple())
+
+        # today isn't over yet, so it is never recorded as fully fetched
+        today = calendar.timegm(datetime.utcnow().date().timetuple())
+
+        for gap_start, gap_end in self.corpus.missing_ranges(keyword, subreddit, comment, start, end, self.query_filters):
+            gap_filename = f"{job_filename}_{gap_start}_{gap_end}"
+            posts = self.fetch_range(
+                keyword, 
+                subreddit, 
+                comment, 
+                gap_filename, 
+                datetime.utcfromtimestamp(gap_start), 
+                datetime.utcfromtimestamp(gap_end))
+
+            self.corpus.add(keyword, subreddit, comment, posts, gap_start, min(gap_end, today), self.query_filters)
+
+            # the corpus holds these records now
+            remove_checkpoints(f"{gap_filename}_comments" if comment else f"{gap_filename}_main")
+
+        return self.corpus.load(keyword, subreddit, comment, start, end, self.query_filters)
+
+
+    def collect_keyword(self, keyword, jobs):
+        filename, filename_complete = self.get_filenames(keyword)
+
+        if jobs is None:
+            return filename_complete
+
+        frames = [future.result() for _, future in jobs]
+
+        if keyword in self.writers:
+            self.close_writer(keyword)
         else:
-            if not self.subreddits:
-                my_reddit = Reddit(
-                    self.restart_from_file, 
-                    self.start_date, 
-                    self.end_date, 
-                    keyword, 
-                    self.include_comments, 
-                    self.save_every, 
-                    filename)
-                posts = my_reddit.posts
-            else:
-                all_posts = []
-                for subreddit in self.subreddits:
-                    my_reddit = Reddit(
-                        self.restart_from_file, 
-                        self.start_date, 
-                        self.end_date, 
-                        keyword, 
-                        self.include_comments, 
-                        self.save_every, 
-                        filename, 
-                        subreddit)
-                    all_posts.append(my_reddit.posts.copy())
-
-                posts = pd.concat(all_posts)
-
-            if posts.empty:
-                print(f"\n\n***\nNo posts for this keyword...\n***\n\n")
-                # continue
-
-            posts.drop_duplicates(inplace=True)
-
-            if self.file_format == "pkl":
-                posts.to_pickle(filename_complete)            
-            elif self.file_format == "json":
-                posts.to_json(filename_complete, orient="records", lines=False)
-            elif self.file_format == "csv":
-                posts.to_csv(filename_complete)
-            
-            #remove the intermediate files
-            for f in [f"{filename}_main.pkl", f"{filename}_comments.pkl"]:
-                if os.path.isfile(f):
-                    os.remove(f)
+            self.write_output(self.concat(frames), filename_complete)
 
+        self.remove_job_checkpoints(jobs)
         return filename_complete
 
 
+    def collect_batch(self, query, jobs):
+        frames = [future.result() for _, future in jobs]
+        matcher = self.matchers.pop(query)
+
+        filenames = []
+        posts = None
+        for keyword in matcher.keywords:
+            filename_complete = self.get_filenames(keyword)[1]
+            if keyword in self.writers:
+                self.close_writer(keyword)
+            else:
+                if posts is None:
+                    posts = matcher.attribute(self.concat(frames))
+                self.write_output(
+                    posts[posts["keyword"] == keyword].copy() if not posts.empty else pd.DataFrame(),
+                    filename_complete)
+            filenames.append(filename_complete)
+
+        self.remove_job_checkpoints(jobs)
+        return filenames
+
+
+    @staticmethod
+    def concat(frames):
+        frames = [df for df in frames if not df.empty]
+        return apply_schema(pd.concat(frames, ignore_index=True)) if frames else pd.DataFrame()
+
+
+    def close_writer(self, keyword):
+        # the file is moved to its final name once complete
+        writer = self.writers.pop(keyword)
+        writer.close()
+        os.replace(writer.path, self.get_filenames(keyword)[1])
+        if not writer.rows:
+            print(f"\n\n***\nNo posts for this keyword...\n***\n\n")
+
+
+    @staticmethod
+    def remove_job_checkpoints(jobs):
+        #remove the intermediate files
+        for job_filename in {job_filename for job_filename, _ in jobs}:
+            for f in [f"{job_filename}_main", f"{job_filename}_comments"]:
+                remove_checkpoints(f)
+
+
+    def write_output(self, posts, filename_complete):
+        if posts.empty:
+            print(f"\n\n***\nNo posts for this keyword...\n***\n\n")
+        else:
+            # the same record pulled twice can differ in score or num_comments, identify it like StreamWriter does
+            posts.drop_duplicates(subset=["id", "is_comment"], inplace=True)
+
+        if self.file_format == "pkl":
+            posts.to_pickle(filename_complete)            
+        elif self.file_format == "json":
+            if "created_utc" in posts.columns:
+                # to_json would write datetimes as epoch milliseconds, keep the "%Y-%m-%d %H:%M:%S" strings of before
+                posts = posts.assign(created_utc=posts["created_utc"].dt.strftime("%Y-%m-%d %H:%M:%S"))
+            posts.to_json(filename_complete, orient="records", lines=False)
+        elif self.file_format == "csv":
+            posts.to_csv(filename_complete)
+
+
     def clean_for_topic_modeling(self):
-        # self.documents = []
-        for filepath in self.output_files:
-            df = pd.read_csv(filepath)
-            try:
-                for ttl, body in zip(df["title"].values, df["body"].values):
-                    if isinstance(ttl, str) and ttl != "":
-                        self.documents.append(ttl)
-                    if isinstance(body, str) and body != "":
-                        self.documents.append(body)
-            except KeyError:
-                # Empty file. No scrape results.
-                pass
\ No newline at end of file
+        self.document_frame = extract_documents(self.output_files, **self.document_filters)
+        self.documents.extend(self.document_frame["text"].tolist())
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from checkpoint import Checkpoint
+from client import PushshiftClient, PushshiftError
+from fake_pushshift import FakePushshift
+from ratelimit import RateLimiter
+from reddit import Reddit
+
+
+START = datetime(2022, 3, 1)
+END = datetime(2022, 3, 3)
+
+
+class FailingClient(PushshiftClient):
+    """Client whose requests start failing after `pages` successful ones."""
+
+    def __init__(self, pages, **kwargs):
+        super().__init__(**kwargs)
+        self.pages = pages
+        self.requests = 0
+
+
+    def get_data(self, url):
+        self.requests += 1
+        if self.pages is not None and self.requests > self.pages:
+            raise PushshiftError(f"failing on purpose for {url}")
+        return super().get_data(url)
+
+
+@pytest.fixture
+def fake_api():
+    fake = FakePushshift("2022-03-01", "2022-03-03", posts_per_day=200, comments_per_day=0)
+    yield fake.serve()
+    fake.stop()
+
+
+def pull(api_url, out_file, restart_from_file, pages=None):
+    client = FailingClient(pages, rate_limiter=RateLimiter(1000, burst=100, max_retries=0), api_url=api_url, page_size=100)
+    reddit = Reddit(restart_from_file, START, END, "water", include_comments=False, save_every=1, out_file=out_file, client=client)
+    return reddit, client
+
+
+def test_checkpoint_roundtrip(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "pull"))
+    checkpoint.add(pd.DataFrame({"id": ["a", "b"], "created_utc_unix": [1, 2]}))
+    checkpoint.flush()
+    checkpoint.add(pd.DataFrame({"id": ["b", "c"], "created_utc_unix": [2, 3]}))
+    checkpoint.flush()
+
+    reopened = Checkpoint(str(tmp_path / "pull"))
+    assert reopened.cursor == 3
+    assert not reopened.complete
+    assert reopened.load()["id"].tolist() == ["a", "b", "c"]
+
+    reopened.finish()
+    assert Checkpoint(str(tmp_path / "pull")).complete
+
+
+def test_resume_after_failure(tmp_path, fake_api):
+    out_file = str(tmp_path / "water")
+
+    with pytest.raises(PushshiftError):
+        pull(fake_api, out_file, restart_from_file=True, pages=2)
+    saved = Checkpoint(f"{out_file}_main")
+    assert saved.manifest["rows"] == 200
+    assert not saved.complete
+
+    resumed, client = pull(fake_api, out_file, restart_from_file=True)
+    full, full_client = pull(fake_api, str(tmp_path / "full"), restart_from_file=False)
+
+    # the two saved pages aren't requested again
+    assert client.requests == full_client.requests - 2
+    assert resumed.posts["id"].is_unique
+    assert sorted(resumed.posts["id"]) == sorted(full.posts["id"])
+    assert len(full.posts) == 400
+
+
+def test_complete_checkpoint_is_read_from_disk(tmp_path, fake_api):
+    out_file = str(tmp_path / "water")
+    first, _ = pull(fake_api, out_file, restart_from_file=True)
+
+    again, client = pull(fake_api, out_file, restart_from_file=True)
+    assert client.requests == 0
+    assert again.posts["id"].tolist() == first.posts["id"].tolist()
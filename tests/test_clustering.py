@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+from clustering import stratified_sample_indices
+
+
+def metadata(sizes, **columns):
+    """One row per document, `sizes` documents in each subreddit."""
+    subreddits = np.repeat(list(sizes), list(sizes.values()))
+    frame = pd.DataFrame({"subreddit": subreddits, "created_utc": pd.Timestamp("2022-03-01 12:00")})
+    return frame.assign(**columns)
+
+
+def counts(frame, indices, column="subreddit"):
+    return frame.iloc[indices][column].value_counts().to_dict()
+
+
+def test_quotas_follow_stratum_sizes():
+    frame = metadata({"a": 600, "b": 300, "c": 100})
+    indices = stratified_sample_indices(frame, 100)
+    assert counts(frame, indices) == {"a": 60, "b": 30, "c": 10}
+    assert np.all(np.diff(indices) > 0)
+
+
+def test_largest_remainder_rounding():
+    frame = metadata({"a": 5, "b": 3, "c": 2})
+    # exact shares are 3.5, 2.1 and 1.4: the half goes to the largest remainder
+    assert counts(frame, stratified_sample_indices(frame, 7)) == {"a": 4, "b": 2, "c": 1}
+
+
+def test_every_stratum_gets_a_document():
+    frame = metadata({"a": 996, "b": 2, "c": 2})
+    assert counts(frame, stratified_sample_indices(frame, 10)) == {"a": 10, "b": 1, "c": 1}
+
+
+def test_days_are_strata():
+    frame = metadata({"a": 100})
+    frame["created_utc"] = pd.to_datetime(["2022-03-01 08:00"] * 80 + ["2022-03-02 23:00"] * 20)
+    indices = stratified_sample_indices(frame, 10)
+    assert frame.iloc[indices]["created_utc"].dt.day.value_counts().to_dict() == {1: 8, 2: 2}
+
+
+def test_small_corpus_is_kept_whole():
+    frame = metadata({"a": 5, "b": 5})
+    assert stratified_sample_indices(frame, 10).tolist() == list(range(10))
+    assert stratified_sample_indices(frame, None).tolist() == list(range(10))
+
+
+def test_same_seed_same_sample():
+    frame = metadata({"a": 600, "b": 400})
+    assert np.array_equal(stratified_sample_indices(frame, 50, seed=3), stratified_sample_indices(frame, 50, seed=3))
@@ -0,0 +1,43 @@
+import pandas as pd
+
+from corpus import Corpus
+
+
+def make_corpus(tmp_path, ranges, filters=None):
+    corpus = Corpus(str(tmp_path / "corpus.db"))
+    for start, end in ranges:
+        corpus.add("water", None, False, pd.DataFrame(), start, end, filters)
+    return corpus
+
+
+def test_nothing_covered(tmp_path):
+    corpus = make_corpus(tmp_path, [])
+    assert corpus.missing_ranges("water", None, False, 0, 100) == [(0, 100)]
+
+
+def test_gaps_between_covered_ranges(tmp_path):
+    corpus = make_corpus(tmp_path, [(10, 20), (40, 50)])
+    assert corpus.missing_ranges("water", None, False, 0, 100) == [(0, 10), (20, 40), (50, 100)]
+
+
+def test_overlapping_and_touching_ranges_merge(tmp_path):
+    corpus = make_corpus(tmp_path, [(30, 60), (10, 40), (60, 70)])
+    assert corpus.covered_ranges("water", None, False) == [(10, 70)]
+    assert corpus.missing_ranges("water", None, False, 0, 100) == [(0, 10), (70, 100)]
+
+
+def test_request_inside_covered_range(tmp_path):
+    corpus = make_corpus(tmp_path, [(0, 100)])
+    assert corpus.missing_ranges("water", None, False, 20, 80) == []
+
+
+def test_covered_ranges_clipped_to_request(tmp_path):
+    corpus = make_corpus(tmp_path, [(0, 30), (70, 200)])
+    assert corpus.missing_ranges("water", None, False, 20, 80) == [(30, 70)]
+
+
+def test_coverage_is_kept_per_scope(tmp_path):
+    corpus = make_corpus(tmp_path, [(0, 100)], filters={"min_score": 5})
+    assert corpus.missing_ranges("water", None, False, 0, 100) == [(0, 100)]
+    assert corpus.missing_ranges("water", None, True, 0, 100, {"min_score": 5}) == [(0, 100)]
+    assert corpus.missing_ranges("water", None, False, 0, 100, {"min_score": 5}) == []
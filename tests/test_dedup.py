@@ -0,0 +1,40 @@
+from dedup import deduplicate
+
+
+BASE = (
+    "the river has been running low all summer and the town council is asking "
+    "everyone to cut their water use until the autumn rains arrive"
+)
+
+
+def groups(texts, **kwargs):
+    """Sets of the positions of the texts grouped together."""
+    representatives, labels = deduplicate(texts, **kwargs)
+    assert len(labels) == len(texts)
+    assert all(labels[n] == position for position, n in enumerate(representatives))
+    found = {}
+    for n, label in enumerate(labels):
+        found.setdefault(int(label), set()).add(n)
+    return sorted(found.values(), key=min)
+
+
+def test_exact_duplicates_ignore_case_and_punctuation():
+    texts = ["Drought, again!", "stock market crash", "drought again", "DROUGHT AGAIN."]
+    assert groups(texts) == [{0, 2, 3}, {1}]
+
+
+def test_near_duplicates_are_grouped():
+    near = BASE.replace("arrive", "come")
+    other = "my cat knocked a glass of water off the table this morning and then looked at me like it was my fault"
+    assert groups([BASE, other, near]) == [{0, 2}, {1}]
+
+
+def test_first_text_represents_its_group():
+    representatives, labels = deduplicate(["something else entirely", BASE, BASE + "!"])
+    assert representatives == [0, 1]
+    assert labels.tolist() == [0, 1, 1]
+
+
+def test_threshold_one_keeps_near_duplicates_apart():
+    near = BASE.replace("arrive", "come")
+    assert groups([BASE, near], threshold=1.0) == [{0}, {1}]
@@ -0,0 +1,59 @@
+import pandas as pd
+
+from fake_pushshift import FakePushshift
+from keywords import KeywordMatcher, keyword_batches, keyword_query
+from reddit import Reddit
+
+
+def posts(*texts):
+    """Cleaned posts with these (title, selftext) pairs, as an OR query returns them."""
+    records = [
+        {"id": f"p{n}", "created_utc": 1646092800 + n, "subreddit": "news", "score": 1,
+         "title": title, "selftext": body, "url": "", "num_comments": 0}
+        for n, (title, body) in enumerate(texts)
+    ]
+    return Reddit.clean_df(pd.DataFrame(records), "query", comment=False)
+
+
+def attributed(matcher, df):
+    result = matcher.attribute(df)
+    return sorted(zip(result["id"], result["keyword"]))
+
+
+def test_one_row_per_matching_keyword():
+    matcher = KeywordMatcher(["drought", "flood", "wildfire"])
+    df = posts(("Drought and FLOOD", ""), ("nothing here", "a wildfire"), ("sunny", "all week"))
+    assert attributed(matcher, df) == [("p0", "drought"), ("p0", "flood"), ("p1", "wildfire")]
+
+
+def test_whole_words_only():
+    matcher = KeywordMatcher(["rain"])
+    df = posts(("training and brain", ""), ("rain, again", ""))
+    assert attributed(matcher, df) == [("p1", "rain")]
+
+
+def test_phrase_spans_whitespace_and_credits_its_words():
+    matcher = KeywordMatcher(["climate", "climate change"])
+    df = posts(("Climate\n  change is here", ""), ("the climate of the debate", ""))
+    assert attributed(matcher, df) == [("p0", "climate"), ("p0", "climate change"), ("p1", "climate")]
+
+
+def test_unmatched_records_are_dropped():
+    matcher = KeywordMatcher(["drought"])
+    assert matcher.attribute(posts(("no match", "at all"),)).empty
+
+
+def test_attributes_fake_pushshift_or_query():
+    keywords = ["drought", "heat wave", "water"]
+    query = keyword_query(keywords)
+    assert keyword_batches(keywords) == [keywords]
+
+    fake = FakePushshift("2022-03-01", "2022-03-02", posts_per_day=300, comments_per_day=0)
+    df = Reddit.clean_df(pd.DataFrame(fake.search("submission", keyword=query, size=300)), query)
+    result = KeywordMatcher(keywords).attribute(df)
+
+    # every record mentions at least one of the keywords, and is split into one row per keyword
+    assert set(result["id"]) == set(df["id"])
+    assert set(result["keyword"]) == set(keywords)
+    for _, row in result.iterrows():
+        assert row["keyword"] in f"{row['title']} {row['body']}".lower()
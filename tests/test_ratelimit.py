@@ -0,0 +1,91 @@
+import time
+from datetime import datetime
+from email.utils import formatdate
+
+import pytest
+
+from client import PushshiftClient, PushshiftError
+from fake_pushshift import FakePushshift
+from ratelimit import RateLimiter
+from reddit import Reddit
+
+
+START = datetime(2022, 3, 1)
+END = datetime(2022, 3, 3)
+
+
+def test_retry_after_seconds():
+    assert RateLimiter.retry_after({"Retry-After": "2.5"}) == 2.5
+    assert RateLimiter.retry_after({"Retry-After": "-3"}) == 0.0
+
+
+def test_retry_after_http_date():
+    delay = RateLimiter.retry_after({"Retry-After": formatdate(time.time() + 30, usegmt=True)})
+    assert 25 < delay <= 30
+
+
+def test_retry_after_unreadable():
+    assert RateLimiter.retry_after({"Retry-After": "soon"}) is None
+
+
+def test_retry_after_falls_back_to_rate_limit_headers():
+    assert RateLimiter.retry_after({"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "12"}) == 12.0
+    assert RateLimiter.retry_after({}) is None
+
+
+def test_exhausted_budget_reset_in_seconds():
+    assert RateLimiter.exhausted_budget_reset({"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "12"}) == 12.0
+
+
+def test_exhausted_budget_reset_as_unix_time():
+    reset = RateLimiter.exhausted_budget_reset({"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(time.time() + 20)})
+    assert 15 < reset <= 20
+
+
+def test_budget_left_or_headers_missing():
+    assert RateLimiter.exhausted_budget_reset({"X-RateLimit-Remaining": "3", "X-RateLimit-Reset": "12"}) is None
+    assert RateLimiter.exhausted_budget_reset({"X-RateLimit-Remaining": "0"}) is None
+    assert RateLimiter.exhausted_budget_reset({"X-RateLimit-Remaining": "none", "X-RateLimit-Reset": "12"}) is None
+
+
+def pull(fake, tmp_path, max_retries=20):
+    api_url = fake.serve()
+    try:
+        rate_limiter = RateLimiter(1000, burst=100, max_retries=max_retries, backoff_base=0.01, backoff_max=0.05)
+        client = PushshiftClient(rate_limiter, api_url=api_url, page_size=100)
+        return Reddit(False, START, END, "water", include_comments=False, out_file=str(tmp_path / "water"), client=client).posts
+    finally:
+        fake.stop()
+
+
+def test_server_errors_are_retried(tmp_path):
+    fake = FakePushshift("2022-03-01", "2022-03-03", posts_per_day=200, comments_per_day=0, error_rate=0.3)
+    posts = pull(fake, tmp_path)
+
+    # a failed page is never taken for the end of the data
+    assert fake.stats["errors"] > 0
+    assert len(posts) == 400
+    assert posts["id"].is_unique
+
+
+def test_rate_limited_requests_are_retried(tmp_path):
+    fake = FakePushshift("2022-03-01", "2022-03-03", posts_per_day=200, comments_per_day=0, requests_per_second=20)
+    posts = pull(fake, tmp_path)
+
+    assert fake.stats["throttled"] > 0
+    assert len(posts) == 400
+
+
+def test_last_attempt_doesnt_back_off(tmp_path):
+    fake = FakePushshift("2022-03-01", "2022-03-03", posts_per_day=200, comments_per_day=0, error_rate=1.0)
+    api_url = fake.serve()
+    try:
+        rate_limiter = RateLimiter(10, max_retries=0)
+        client = PushshiftClient(rate_limiter, api_url=api_url)
+        with pytest.raises(PushshiftError):
+            client.get_data(f"{api_url}/reddit/search/submission/?q=water&size=100")
+    finally:
+        fake.stop()
+
+    assert rate_limiter.rate == 10
+    assert rate_limiter._paused_until <= time.monotonic()
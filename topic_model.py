@@ -1,34 +1,468 @@
+import time
+import collections
+from contextlib import contextmanager
+
+import numpy as np
 import pandas as pd
 from bertopic import BERTopic
-from sentence_transformers import SentenceTransformer
 
+from embeddings import EmbeddingCache, Embedder
+from artifacts import ARTIFACTS, SeenDocuments, latest_version, load_artifact, save_artifact
+from documents import extract_documents
+from dedup import deduplicate
+from metrics import METRICS, profile
+from clustering import PRESETS, sample_indices, stratified_sample_indices, topic_agreement, topic_model_components
+
+
+# BERTopic's default model for english documents
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_CACHE = "data/embeddings"
+
+
+def embed(docs, embedder=None, cache_dir=EMBEDDING_CACHE, cache_max_bytes=None, cache=None):
+    """Embeds documents, reusing the embeddings cached by previous runs.
+
+    Args:
+        docs (list of str): documents to embed
+        embedder (Embedder, optional): embedding stage. Defaults to EMBEDDING_MODEL with default settings.
+        cache_dir (str, optional): embedding cache folder. if none, nothing is cached.
+        cache_max_bytes (int, optional): size limit of the cache. if none, the cache is never evicted.
+        cache (EmbeddingCache, optional): an open cache of `embedder`, used instead of opening the one in `cache_dir`.
+
+    Returns:
+        tuple of the embedder and the embeddings array
+    """
+    embedder = embedder or Embedder(EMBEDDING_MODEL)
+
+    with METRICS.timer("embedding_seconds"):
+        if cache is None:
+            if not cache_dir:
+                return embedder, embedder.encode(docs)
+            cache = EmbeddingCache(cache_dir, embedder.model_name, embedder.version, cache_max_bytes)
+        return embedder, cache.encode(docs, embedder.encode)
+
+
+def configured_embedder(settings):
+    """The embedding stage set up by the topic_model settings of a config: embedding_batch_size, embedding_processes and quantize."""
+    return Embedder(
+        EMBEDDING_MODEL,
+        batch_size=settings.get("embedding_batch_size") or 64,
+        processes=settings.get("embedding_processes"),
+        quantize=settings.get("quantize", False))
+
+
+def collapse_duplicates(docs, threshold=0.8):
+    """Keeps one document of every group of exact and near duplicates, see dedup.deduplicate.
+
+    Args:
+        docs (list of str): documents
+        threshold (float, optional): similarity above which documents are near duplicates. if none, nothing is collapsed.
+
+    Returns:
+        tuple of the positions of the unique documents in `docs` and, for every document, the position of its unique document among them
+    """
+    if threshold is None:
+        return np.arange(len(docs)), np.arange(len(docs))
+
+    with METRICS.timer("dedup_seconds"):
+        representatives, labels = deduplicate(docs, threshold)
+    print(f"Collapsed {len(docs)} documents into {len(representatives)} unique ones")
+    return np.asarray(representatives), labels
+
+
+def count_topics(model, topics):
+    """Sets the topic sizes of `model` from the topics of all documents, so duplicates weigh in.
+
+    Only the sizes are weighted. The topic words (c-TF-IDF) stay computed from
+    one document per duplicate group, so a bot comment or copy-pasta posted a
+    thousand times doesn't take over the words of its topic.
+    """
+    model.topic_sizes_ = dict(collections.Counter(topics))
+
+
+@contextmanager
+def instrument(model):
+    """Times the stages of BERTopic's fit inside the block: reduction, clustering and topic representation."""
+    stages = {
+        "_reduce_dimensionality": "reduction_seconds",
+        "_cluster_embeddings": "clustering_seconds",
+        "_extract_topics": "representation_seconds",
+    }
+    # set on the instance only, so the model pickles without them once they are removed
+    for method, metric in stages.items():
+        setattr(model, method, METRICS.timed(metric, getattr(model, method)))
+    try:
+        yield model
+    finally:
+        for method in stages:
+            delattr(model, method)
+
+
+def assign_topics(model, docs, embeddings, batch_size=10000):
+    """Assigns topics with a fitted model, `batch_size` documents at a time to bound memory."""
+    topics = []
+    for start in range(0, len(docs), batch_size):
+        with METRICS.timer("assign_seconds"):
+            batch_topics, _ = model.transform(docs[start:start + batch_size], embeddings[start:start + batch_size])
+        topics.extend(batch_topics)
+    return topics
+
+
+def fit_on_sample(docs, embeddings, sample, preset="default", n_components=5, n_clusters=50):
+    """Fits a new BERTopic model on the documents at the positions `sample` and assigns the rest to its topics.
+
+    Returns:
+        tuple of the model and an array with the topic of every document
+    """
+    model = BERTopic(verbose=True, **topic_model_components(preset, n_components, n_clusters))
+    if len(sample) == len(docs):
+        with instrument(model), METRICS.timer("fit_seconds"):
+            topics, probs = model.fit_transform(docs, embeddings)
+        return model, np.asarray(topics)
+
+    print(f"Fitting on {len(sample)} of {len(docs)} unique documents")
+    with instrument(model), METRICS.timer("fit_seconds"):
+        sample_topics, probs = model.fit_transform([docs[n] for n in sample], embeddings[sample])
+
+    rest = np.setdiff1d(np.arange(len(docs)), sample)
+    topics = np.empty(len(docs), dtype=np.int64)
+    topics[sample] = sample_topics
+    topics[rest] = assign_topics(model, [docs[n] for n in rest], embeddings[rest])
+    return model, topics
+
+
+def draw_sample(n, sample_size, metadata=None):
+    """Stratified sample when there is metadata to stratify by, uniform otherwise."""
+    if metadata is None:
+        return sample_indices(n, sample_size)
+    return stratified_sample_indices(metadata, sample_size)
+
+
+def topic_model(docs, embedder=None, cache_dir=EMBEDDING_CACHE, cache_max_bytes=None, artifact_dir=ARTIFACTS, dedup_threshold=0.8,
+                preset="default", n_components=5, n_clusters=50, sample_size=None, metadata=None):
+    """Fits a topic model on all documents and saves it as a new version of the "batch" model.
+
+    The embedding model isn't attached to BERTopic: embeddings are always
+    computed (or read from the cache) by the embedding stage, so a rerun on
+    cached documents never loads it. Cross-posts, bot comments and copy-pasta
+    are collapsed first: only unique documents are embedded and clustered,
+    and every duplicate gets the topic of the document it was collapsed into.
+
+    On large corpora, pick a fast preset (see clustering.topic_model_components)
+    and/or a `sample_size`: the model is then fitted on a sample and the
+    remaining documents are only assigned to its topics. With `metadata`, the
+    sample is stratified by subreddit, keyword, day and post/comment; use
+    sample_agreement to choose its size.
+
+    Args:
+        docs (list of str): documents
+        embedder (Embedder, optional): embedding stage. Defaults to EMBEDDING_MODEL with default settings.
+        cache_dir (str, optional): embedding cache folder. if none, nothing is cached.
+        cache_max_bytes (int, optional): size limit of the cache. if none, the cache is never evicted.
+        artifact_dir (str, optional): artifacts folder. if none, the model isn't saved.
+        dedup_threshold (float, optional): similarity above which documents are near duplicates. if none, nothing is collapsed.
+        preset (str, optional): reduction and clustering preset, one of clustering.PRESETS. Defaults to "default".
+        n_components (int, optional): dimensions kept by the fast presets. Defaults to 5.
+        n_clusters (int, optional): number of topics of the fast presets. Defaults to 50.
+        sample_size (int, optional): unique documents the model is fitted on. if none, all of them.
+        metadata (dataframe, optional): one row per document, e.g. Scrape.document_frame. if none, the sample is uniform.
+
+    Returns:
+        list with the topic of every document
+    """
+    representatives, labels = collapse_duplicates(docs, dedup_threshold)
+    unique_docs = [docs[n] for n in representatives]
+
+    embedder, embeddings = embed(unique_docs, embedder, cache_dir, cache_max_bytes)
+
+    unique_metadata = metadata.iloc[representatives] if metadata is not None else None
+    sample = draw_sample(len(unique_docs), sample_size, unique_metadata)
+    model, unique_topics = fit_on_sample(unique_docs, embeddings, sample, preset, n_components, n_clusters)
+
+    topics = unique_topics[labels].tolist()
+    count_topics(model, topics)
+
+    if artifact_dir:
+        path = save_artifact(
+            model, embedder, "batch", artifact_dir,
+            n_docs=len(docs), n_unique_docs=len(unique_docs), n_fitted_docs=len(sample), preset=preset)
+        print(f"Saved topic model to {path}")
+    return topics
+
+
+def sample_agreement(docs, sample_sizes, embedder=None, cache_dir=EMBEDDING_CACHE, cache_max_bytes=None, dedup_threshold=0.8,
+                     preset="default", n_components=5, n_clusters=50, metadata=None):
+    """Compares models fitted on samples of several sizes with a model fitted on all documents.
+
+    Nothing is saved. Agreement is measured over all documents, duplicates
+    included, see clustering.topic_agreement.
+
+    Args:
+        docs (list of str): documents
+        sample_sizes (list of int): sample sizes to try
+        metadata (dataframe, optional): one row per document to stratify the samples by. if none, samples are uniform.
+        see topic_model for the other arguments
+
+    Returns:
+        dataframe with the fit time, number of topics, ari and nmi of every sample size
+    """
+    representatives, labels = collapse_duplicates(docs, dedup_threshold)
+    unique_docs = [docs[n] for n in representatives]
+    embedder, embeddings = embed(unique_docs, embedder, cache_dir, cache_max_bytes)
+    unique_metadata = metadata.iloc[representatives] if metadata is not None else None
+
+    results = []
+    reference = None
+    for sample_size in [None] + sorted(sample_sizes, reverse=True):
+        start = time.time()
+        sample = draw_sample(len(unique_docs), sample_size, unique_metadata)
+        model, unique_topics = fit_on_sample(unique_docs, embeddings, sample, preset, n_components, n_clusters)
+        topics = unique_topics[labels]
+        if reference is None:
+            reference = topics
+
+        results.append(dict(
+            sample_size=len(sample),
+            seconds=time.time() - start,
+            topics=len(set(topics.tolist())),
+            **topic_agreement(reference, topics)))
+
+    return pd.DataFrame(results)
+
+
+def online_topic_model(n_components=5, n_clusters=50, decay=0.01):
+    """Creates a BERTopic model that can be updated batch by batch with partial_fit.
+
+    UMAP and HDBSCAN can't learn incrementally, so they are replaced by
+    IncrementalPCA and MiniBatchKMeans. Clusters keep their ids between
+    updates, and the vocabulary grows with every batch while old word counts
+    decay, so topics follow the corpus without renumbering.
+
+    Args:
+        n_components (int, optional): dimensions kept by IncrementalPCA. Defaults to 5.
+        n_clusters (int, optional): number of topics. Defaults to 50.
+        decay (float, optional): how much of the old word counts is forgotten on every update. Defaults to 0.01.
+
+    Returns:
+        BERTopic model
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.decomposition import IncrementalPCA
+    from bertopic.vectorizers import OnlineCountVectorizer
+
+    return BERTopic(
+        umap_model=IncrementalPCA(n_components=n_components),
+        hdbscan_model=MiniBatchKMeans(n_clusters=n_clusters, random_state=0),
+        vectorizer_model=OnlineCountVectorizer(stop_words="english", decay=decay),
+        verbose=True)
+
+
+def update_topic_model(docs, embedder=None, cache_dir=EMBEDDING_CACHE, cache_max_bytes=None, n_clusters=50, artifact_dir=ARTIFACTS, dedup_threshold=0.8):
+    """Updates the latest "online" model with a new batch of documents and saves the result as its next version.
+    The first call creates the model; its first batch needs at least `n_clusters` unique documents.
+
+    The model remembers the sha1 digest of every document it was updated
+    with (see artifacts.SeenDocuments), so a batch overlapping earlier ones (e.g. a rescrape of the same
+    files) only updates it with the new documents, and its document count
+    stays right. The documents it has seen are just assigned to its topics.
+
+    Args:
+        docs (list of str): documents
+        embedder (Embedder, optional): embedding stage. Defaults to EMBEDDING_MODEL with default settings.
+            Once the model exists, only its batch size and processes are used: the model and
+            quantization stay the ones the saved model was fitted with.
+        cache_dir (str, optional): embedding cache folder. if none, nothing is cached.
+        cache_max_bytes (int, optional): size limit of the cache. if none, the cache is never evicted.
+        n_clusters (int, optional): number of topics of a new model. Defaults to 50.
+        artifact_dir (str, optional): artifacts folder. Defaults to ARTIFACTS.
+        dedup_threshold (float, optional): similarity above which documents of the batch are near duplicates. if none, nothing is collapsed.
+
+    Returns:
+        list with the topic of every document in `docs`
+    """
+    seen_documents = SeenDocuments("online", artifact_dir)
+    try:
+        model, meta = load_artifact("online", artifact_dir)
+        embedder = Embedder(
+            meta["embedding_model"],
+            batch_size=embedder.batch_size if embedder else 64,
+            processes=embedder.processes if embedder else None,
+            quantize=meta["quantize"])
+        n_docs = meta["n_docs"]
+    except FileNotFoundError:
+        model = None
+        n_docs = 0
+        # left behind by a model that was deleted
+        seen_documents.clear()
+
+    digests = [SeenDocuments.digest(doc) for doc in docs]
+    seen = seen_documents.seen(digests)
+    new = [n for n, digest in enumerate(digests) if digest not in seen]
+    topics = [None] * len(docs)
+
+    if new:
+        new_docs = [docs[n] for n in new]
+        representatives, labels = collapse_duplicates(new_docs, dedup_threshold)
+        unique_docs = [new_docs[n] for n in representatives]
+        if model is None:
+            if len(unique_docs) < n_clusters:
+                raise ValueError(f"The first batch needs at least {n_clusters} unique documents, got {len(unique_docs)}")
+            model = online_topic_model(n_clusters=n_clusters)
 
+        embedder, embeddings = embed(unique_docs, embedder, cache_dir, cache_max_bytes)
+
+        # MiniBatchKMeans keeps the dtype of its first batch and rejects later ones that differ
+        with instrument(model), METRICS.timer("fit_seconds"):
+            model.partial_fit(unique_docs, embeddings.astype(np.float64))
+        for n, topic in zip(new, np.asarray(model.topics_)[labels].tolist()):
+            topics[n] = topic
+
+        path = save_artifact(model, embedder, "online", artifact_dir, n_docs=n_docs + len(new))
+        seen_documents.add((digests[n] for n in new), latest_version("online", artifact_dir))
+        print(f"Saved topic model to {path}")
+    seen_documents.close()
+
+    old = [n for n in range(len(docs)) if topics[n] is None]
+    if old:
+        print(f"{len(old)} of {len(docs)} documents were already seen by the online model, only assigning their topics")
+        old_docs = [docs[n] for n in old]
+        embedder, embeddings = embed(old_docs, embedder, cache_dir, cache_max_bytes)
+        with METRICS.timer("assign_seconds"):
+            old_topics, _ = model.transform(old_docs, embeddings.astype(np.float64))
+        for n, topic in zip(old, old_topics):
+            topics[n] = int(topic)
 
-def topic_model(docs):
-    model = BERTopic(verbose=True)
-    topics, probs = model.fit_transform(docs)
     return topics
 
 
-def clean_for_topic_modeling(output_files):
-    documents = []
-    for filepath in output_files:
-        df = pd.read_csv(filepath)
-        for ttl, body in zip(df["title"].values, df["body"].values):
-            if isinstance(ttl, str) and ttl != "":
-                documents.append(ttl)
-            if isinstance(body, str) and body != "":
-                documents.append(body)
-    return documents
+class TopicClassifier:
+    def __init__(self, name="batch", version=None, artifact_dir=ARTIFACTS, cache_dir=EMBEDDING_CACHE, cache_max_bytes=None, batch_size=1000,
+                 embedding_batch_size=64, embedding_processes=None):
+        """Assigns topics with a saved model, without any fitting.
+        The model is loaded on the first call to transform.
+
+        Args:
+            name (str, optional): "batch" or "online". Defaults to "batch".
+            version (str, optional): e.g. "v0003". if none, the newest version.
+            artifact_dir (str, optional): artifacts folder. Defaults to ARTIFACTS.
+            cache_dir (str, optional): embedding cache folder. if none, nothing is cached.
+            cache_max_bytes (int, optional): size limit of the cache. if none, the cache is never evicted.
+            batch_size (int, optional): documents embedded and classified at a time. Defaults to 1000.
+            embedding_batch_size (int, optional): documents per forward pass of the embedding model. Defaults to 64.
+            embedding_processes (int, optional): embedding worker processes, see embeddings.Embedder.
+        """
+        self.name = name
+        self.version = version
+        self.artifact_dir = artifact_dir
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.batch_size = batch_size
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_processes = embedding_processes
+        self.model = None
+        self.meta = None
+        self.embedder = None
+        self.cache = None
+
+
+    def load(self):
+        if self.model is None:
+            self.model, self.meta = load_artifact(self.name, self.artifact_dir, self.version)
+            self.embedder = Embedder(
+                self.meta["embedding_model"],
+                batch_size=self.embedding_batch_size,
+                processes=self.embedding_processes,
+                quantize=self.meta["quantize"])
+            # opened once, reading the index of every shard is too slow to repeat for each batch
+            if self.cache_dir:
+                self.cache = EmbeddingCache(self.cache_dir, self.embedder.model_name, self.embedder.version, self.cache_max_bytes)
+        return self.model
+
+
+    def transform(self, docs):
+        """Returns the topic and its probability for every document.
+
+        Returns:
+            tuple of a topic list and a probability list (None when the clustering model has no probabilities)
+        """
+        model = self.load()
+
+        topics, probs = [], []
+        for start in range(0, len(docs), self.batch_size):
+            batch = docs[start:start + self.batch_size]
+            _, embeddings = embed(batch, self.embedder, self.cache_dir, cache=self.cache)
+            if self.name == "online":
+                embeddings = embeddings.astype(np.float64)
+
+            with METRICS.timer("assign_seconds"):
+                batch_topics, batch_probs = model.transform(batch, embeddings)
+            topics.extend(batch_topics)
+            probs.extend(batch_probs if batch_probs is not None else [None] * len(batch))
+
+        return topics, probs
+
+
+def clean_for_topic_modeling(output_files, **filters):
+    """Returns the texts of the documents in scrape output files, see documents.iter_documents."""
+    return extract_documents(output_files, **filters)["text"].tolist()
 
 
 
 if __name__ == "__main__":
-    output_files = [
-        "data/reddit_water_2022-03-01_2022-03-30_complete.csv"
-    ]
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fit, update or apply the topic model on scraped csv files.")
+    parser.add_argument("command", choices=["fit", "update", "transform", "agreement", "over-time"])
+    parser.add_argument("files", nargs="+", help="scrape output files")
+    parser.add_argument("--model", default="batch", help="saved model to use with transform: batch or online")
+    parser.add_argument("--output", help="csv file for the topics assigned by transform or over-time")
+    parser.add_argument("--preset", choices=PRESETS, default="default", help="reduction and clustering used by fit")
+    parser.add_argument("--n-clusters", type=int, default=50, help="number of topics of the fast presets and of a new online model")
+    parser.add_argument("--sample-size", type=int, help="fit on a stratified sample of this many documents and assign the rest")
+    parser.add_argument("--bin", choices=["hour", "day", "week"], default="day", help="time bins of over-time")
+    parser.add_argument("--sample-sizes", type=int, nargs="+", default=[1000, 10000], help="sample sizes compared by agreement")
+    parser.add_argument("--embedding-batch-size", type=int, default=64, help="documents per forward pass of the embedding model")
+    parser.add_argument("--embedding-processes", type=int, help="embedding worker processes, by default one per core for large inputs")
+    parser.add_argument("--quantize", action="store_true", help="embed with int8 dynamic quantization, used by fit, agreement and a new online model")
+    parser.add_argument("--cache-max-bytes", type=int, help="size limit of the embedding cache, the least recently used embeddings are evicted above it")
+    parser.add_argument("--metrics-jsonl", help="append every measurement to this JSON-lines file")
+    parser.add_argument("--metrics-prometheus", help="write the metrics to this file in the Prometheus text format")
+    parser.add_argument("--profile", help="save a cProfile of the command to this file")
+    args = parser.parse_args()
+    METRICS.configure(args.metrics_jsonl)
+
+    embedder = Embedder(EMBEDDING_MODEL, args.embedding_batch_size, args.embedding_processes, args.quantize)
+
+    with profile(args.profile):
+        document_frame = extract_documents(args.files)
+        documents = document_frame["text"].tolist()
+        print(f"Loaded {len(documents)} documents.")
+
+        classifier = TopicClassifier(
+            args.model, cache_max_bytes=args.cache_max_bytes,
+            embedding_batch_size=args.embedding_batch_size, embedding_processes=args.embedding_processes)
+
+        if args.command == "fit":
+            topics = topic_model(
+                documents, embedder, cache_max_bytes=args.cache_max_bytes, preset=args.preset, n_clusters=args.n_clusters,
+                sample_size=args.sample_size, metadata=document_frame)
+        elif args.command == "agreement":
+            topics = sample_agreement(
+                documents, args.sample_sizes, embedder, cache_max_bytes=args.cache_max_bytes, preset=args.preset,
+                n_clusters=args.n_clusters, metadata=document_frame)
+        elif args.command == "update":
+            topics = update_topic_model(documents, embedder, cache_max_bytes=args.cache_max_bytes, n_clusters=args.n_clusters)
+        elif args.command == "over-time":
+            from topics_over_time import TopicsOverTime
+
+            topics = TopicsOverTime(classifier, args.bin).compute(document_frame)
+            if args.output:
+                topics.to_csv(args.output, index=False)
+        else:
+            topics, probs = classifier.transform(documents)
+            if args.output:
+                pd.DataFrame({"document": documents, "topic": topics, "probability": probs}).to_csv(args.output, index=False)
 
-    documents = clean_for_topic_modeling(output_files)
-    print(f"Loaded {len(documents)} documents.")
-    topics = topic_model(documents)
+    if args.metrics_prometheus:
+        METRICS.write_prometheus(args.metrics_prometheus)
     print(topics)
@@ -0,0 +1,228 @@
+import os
+import hashlib
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from checkpoint import write_atomic
+
+
+TOPICS_OVER_TIME = "data/topics_over_time"
+
+# pandas period of every bin size
+BINS = {"hour": "H", "day": "D", "week": "W"}
+
+# the bin size cached on disk for every bin size, coarser bins are summed from it
+CACHED_BINS = {"hour": "hour", "day": "day", "week": "day"}
+
+
+class TopicsOverTime:
+    def __init__(self, classifier, bin_size="day", cache_dir=TOPICS_OVER_TIME, key="default", top_n_words=5):
+        """Topic frequencies and representations per time bin, cached day by day.
+
+        For every day (or hour, with hourly bins), the number of documents of
+        each topic and the summed word counts of those documents are stored in
+        one file. Counts add up, so weekly bins are summed from the cached days
+        and only the days that changed since the last run are classified: a
+        daily scrape reclassifies one day, not the whole week. A day file is
+        named after a digest of the day's texts, so it is only reused for
+        exactly the same documents, and replaces the file of that day computed
+        for other documents; keep document sets that are analysed side by side
+        apart with `key`. The representation of a topic in a bin is the c-TF-IDF
+        of its word counts, weighted by the model's own idf.
+
+        Args:
+            classifier (TopicClassifier): saved model assigning the topics
+            bin_size (str, optional): "hour", "day" or "week". Defaults to "day".
+            cache_dir (str, optional): root folder of the cache. Defaults to TOPICS_OVER_TIME.
+            key (str, optional): folder of the cached bins, e.g. to clear the cache of one corpus. Defaults to "default".
+            top_n_words (int, optional): words describing a topic in a bin. Defaults to 5.
+        """
+        if bin_size not in BINS:
+            raise ValueError(f"Unknown bin size {bin_size}, use one of {list(BINS)}")
+
+        self.classifier = classifier
+        self.bin_size = bin_size
+        self.cached_bin_size = CACHED_BINS[bin_size]
+        self.cache_dir = cache_dir
+        self.key = key
+        self.top_n_words = top_n_words
+
+
+    @property
+    def directory(self):
+        # topic ids and vocabulary belong to one model version
+        meta = self.classifier.meta
+        return os.path.join(self.cache_dir, meta["name"], meta["version"], self.key, self.cached_bin_size)
+
+
+    def bin_file(self, timestamp, digest):
+        return os.path.join(self.directory, f"{timestamp.strftime('%Y%m%dT%H%M%S')}_{digest}.npz")
+
+
+    @staticmethod
+    def bins(created_utc, bin_size):
+        """Start of the bin of every timestamp."""
+        return pd.to_datetime(created_utc).dt.to_period(BINS[bin_size]).dt.start_time
+
+
+    @staticmethod
+    def digests(texts, bins):
+        """Digest of the texts of every bin, independent of their order."""
+        hashes = pd.util.hash_pandas_object(texts.reset_index(drop=True), index=False).to_numpy()
+        groups = pd.Series(hashes).groupby(bins.to_numpy())
+        return {
+            pd.Timestamp(timestamp): hashlib.sha1(np.sort(group.to_numpy()).tobytes()).hexdigest()[:16]
+            for timestamp, group in groups
+        }
+
+
+    def compute(self, frame):
+        """Returns the frequency and representation of every topic in every bin.
+
+        Args:
+            frame (dataframe): documents with a text and created_utc column, e.g. Scrape.document_frame
+
+        Returns:
+            dataframe with the Topic, Words, Frequency and Timestamp columns of
+            BERTopic.topics_over_time, so it can be plotted with visualize_topics_over_time
+        """
+        model = self.classifier.load()
+        os.makedirs(self.directory, exist_ok=True)
+
+        bins = self.bins(frame["created_utc"], self.cached_bin_size)
+        digests = self.digests(frame["text"], bins)
+
+        aggregates = {}
+        missing = []
+        for timestamp, digest in digests.items():
+            path = self.bin_file(timestamp, digest)
+            if os.path.isfile(path):
+                aggregates[timestamp] = self.read_bin(path)
+            else:
+                missing.append(timestamp)
+
+        print(f"Topics over time: {len(aggregates)} cached bins, {len(missing)} to compute")
+        if missing:
+            rows = bins.isin(missing).to_numpy()
+            computed = self.aggregate(model, frame["text"][rows].tolist(), bins[rows])
+            for timestamp, aggregate in computed.items():
+                path = self.bin_file(timestamp, digests[timestamp])
+                self.write_bin(path, *aggregate)
+                self.remove_superseded(timestamp, path)
+                aggregates[timestamp] = aggregate
+
+        return self.represent(model, self.merge(aggregates))
+
+
+    def remove_superseded(self, timestamp, path):
+        """Deletes the files of the bin starting at `timestamp` that were computed for other documents than `path`."""
+        prefix = f"{timestamp.strftime('%Y%m%dT%H%M%S')}_"
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(".npz") and name != os.path.basename(path):
+                os.remove(os.path.join(self.directory, name))
+
+
+    def merge(self, aggregates):
+        """Sums the aggregates of the cached bins into bins of bin_size."""
+        if self.bin_size == self.cached_bin_size:
+            return aggregates
+
+        parts = {}
+        for timestamp, aggregate in aggregates.items():
+            parts.setdefault(timestamp.to_period(BINS[self.bin_size]).start_time, []).append(aggregate)
+
+        merged = {}
+        for timestamp, bin_parts in parts.items():
+            topics = np.concatenate([part[0] for part in bin_parts])
+            frequencies = np.concatenate([part[1] for part in bin_parts])
+            word_counts = sp.vstack([part[2] for part in bin_parts]).tocsr()
+
+            unique_topics, group = np.unique(topics, return_inverse=True)
+            indicator = sp.csr_matrix(
+                (np.ones(len(topics)), (group, np.arange(len(topics)))), shape=(len(unique_topics), len(topics)))
+            merged[timestamp] = (
+                unique_topics,
+                np.bincount(group, weights=frequencies).astype(frequencies.dtype),
+                sp.csr_matrix(indicator @ word_counts))
+        return merged
+
+
+    def aggregate(self, model, docs, bins):
+        """Classifies documents and sums their topics and word counts per bin.
+
+        Returns:
+            dictionary mapping every bin to a tuple of its topics, their document counts and their word counts
+        """
+        topics, _ = self.classifier.transform(docs)
+        word_counts = model.vectorizer_model.transform(docs)
+
+        groups = pd.DataFrame({"bin": bins.to_numpy(), "topic": topics}).groupby(["bin", "topic"])
+        group = groups.ngroup().to_numpy()
+        indicator = sp.csr_matrix(
+            (np.ones(len(docs)), (group, np.arange(len(docs)))), shape=(groups.ngroups, len(docs)))
+        group_counts = sp.csr_matrix(indicator @ word_counts)
+
+        keys = pd.DataFrame(list(groups.groups.keys()), columns=["bin", "topic"])
+        keys["frequency"] = groups.size().to_numpy()
+
+        aggregates = {}
+        for timestamp, rows in keys.groupby("bin").indices.items():
+            aggregates[pd.Timestamp(timestamp)] = (
+                keys["topic"].to_numpy()[rows],
+                keys["frequency"].to_numpy()[rows],
+                group_counts[rows])
+        return aggregates
+
+
+    def represent(self, model, aggregates):
+        """Turns the aggregates of every bin into BERTopic's topics_over_time format."""
+        if not aggregates:
+            return pd.DataFrame(columns=["Topic", "Words", "Frequency", "Timestamp"])
+
+        timestamps = sorted(aggregates)
+        topics = np.concatenate([aggregates[t][0] for t in timestamps])
+        frequencies = np.concatenate([aggregates[t][1] for t in timestamps])
+        word_counts = sp.vstack([aggregates[t][2] for t in timestamps]).tocsr()
+        bin_of_row = np.repeat(timestamps, [len(aggregates[t][0]) for t in timestamps])
+
+        words = np.asarray(model.vectorizer_model.get_feature_names_out())
+        weights = sp.csr_matrix(model.ctfidf_model.transform(word_counts))
+
+        # top words row by row, a dense bins x topics x vocabulary matrix wouldn't fit in memory
+        top_words = []
+        for n in range(weights.shape[0]):
+            row = slice(weights.indptr[n], weights.indptr[n + 1])
+            top = np.argsort(-weights.data[row], kind="stable")[:self.top_n_words]
+            top_words.append(", ".join(words[weights.indices[row][top]]))
+
+        return pd.DataFrame({
+            "Topic": topics,
+            "Words": top_words,
+            "Frequency": frequencies,
+            "Timestamp": bin_of_row,
+        })
+
+
+    @staticmethod
+    def read_bin(path):
+        with np.load(path) as f:
+            word_counts = sp.csr_matrix((f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"]))
+            return f["topics"], f["frequencies"], word_counts
+
+
+    @staticmethod
+    def write_bin(path, topics, frequencies, word_counts):
+        def save(tmp_path):
+            np.savez(
+                tmp_path,
+                topics=topics,
+                frequencies=frequencies,
+                data=word_counts.data,
+                indices=word_counts.indices,
+                indptr=word_counts.indptr,
+                shape=np.array(word_counts.shape))
+
+        # np.savez appends .npz to any other name
+        write_atomic(path, save, suffix=".tmp.npz")
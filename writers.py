@@ -0,0 +1,150 @@
+import gzip
+import threading
+
+import pandas as pd
+
+from schema import apply_schema
+
+
+STREAMING_FORMATS = ["jsonl", "parquet"]
+
+
+class StreamWriter:
+    def __init__(self, path):
+        """Writes pages to disk as they arrive, skipping records already written.
+
+        Records are identified by their reddit fullname (t3_ for posts, t1_ for
+        comments), so the seen-set only holds one short string per record.
+
+        Args:
+            path (str): file to write to
+        """
+        self.path = path
+        self.seen = set()
+        self.rows = 0
+        self._lock = threading.Lock()
+
+
+    def write(self, df):
+        """Appends the records of `df` that weren't written yet. Safe to call from several threads."""
+        if df.empty:
+            return
+
+        prefix = df["is_comment"].map({True: "t1_", False: "t3_"})
+        fullnames = (prefix + df["id"].astype(str)).tolist()
+
+        with self._lock:
+            keep = []
+            for fullname in fullnames:
+                is_new = fullname not in self.seen
+                keep.append(is_new)
+                if is_new:
+                    self.seen.add(fullname)
+
+            new_rows = df[keep]
+            if not new_rows.empty:
+                self.write_rows(new_rows)
+                self.rows += len(new_rows)
+
+
+    def write_rows(self, df):
+        raise NotImplementedError
+
+
+    def close(self):
+        raise NotImplementedError
+
+
+class JsonLinesWriter(StreamWriter):
+    def __init__(self, path, compression=None):
+        """Newline-delimited JSON, one record per line.
+
+        Args:
+            path (str): file to write to
+            compression (str, optional): "gzip" to compress the stream. Defaults to None.
+        """
+        super().__init__(path)
+        if compression == "gzip":
+            self.file = gzip.open(path, "wt", encoding="utf-8")
+        elif compression:
+            raise ValueError(f"Unsupported compression for jsonl: {compression}")
+        else:
+            self.file = open(path, "w", encoding="utf-8")
+
+
+    def write_rows(self, df):
+        lines = df.to_json(orient="records", lines=True, date_format="iso")
+        self.file.write(lines if lines.endswith("\n") else lines + "\n")
+        self.file.flush()
+
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter(StreamWriter):
+    def __init__(self, path, compression="snappy"):
+        """Parquet file with one row group per page. Needs pyarrow.
+
+        Args:
+            path (str): file to write to
+            compression (str, optional): parquet codec, e.g. "snappy", "gzip", "zstd" or "none". Defaults to "snappy".
+        """
+        super().__init__(path)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("file_format 'parquet' needs pyarrow, install it with `pip install pyarrow`")
+
+        self.pa = pa
+        self.pq = pq
+        self.compression = compression or "none"
+        self.writer = None
+
+
+    def write_rows(self, df):
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.path, table.schema, compression=self.compression)
+        else:
+            table = table.cast(self.writer.schema)
+        self.writer.write_table(table)
+
+
+    def close(self):
+        if self.writer is None:
+            # nothing was scraped, still leave a readable (empty) file behind
+            pd.DataFrame().to_parquet(self.path)
+        else:
+            self.writer.close()
+
+
+def open_writer(path, file_format, compression=None):
+    """Returns the stream writer for `file_format` ("jsonl" or "parquet")."""
+    if file_format == "jsonl":
+        return JsonLinesWriter(path, compression)
+    elif file_format == "parquet":
+        return ParquetWriter(path, compression or "snappy")
+    raise ValueError(f"{file_format} is not a streaming format, use one of {STREAMING_FORMATS}")
+
+
+def read_output(filepath):
+    """Reads a scrape output file in any of the supported formats.
+
+    Returns:
+        dataframe typed according to schema.SCHEMA
+    """
+    if filepath.endswith(".csv"):
+        df = pd.read_csv(filepath)
+    elif filepath.endswith(".pkl"):
+        df = pd.read_pickle(filepath)
+    elif filepath.endswith(".parquet"):
+        df = pd.read_parquet(filepath)
+    elif ".jsonl" in filepath:
+        df = pd.read_json(filepath, orient="records", lines=True)
+    elif filepath.endswith(".json"):
+        df = pd.read_json(filepath, orient="records")
+    else:
+        raise ValueError(f"Unknown output format: {filepath}")
+    return apply_schema(df)